@@ -3,14 +3,47 @@
 import json
 import hashlib
 import base64
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, g, has_request_context
+from flask import before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import os
 from werkzeug.utils import secure_filename
+import click
+from flask.cli import AppGroup
+from jinja2 import FileSystemBytecodeCache
 from dotenv import load_dotenv
-from sqlalchemy import event
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+import time
+import re
+from collections import OrderedDict, namedtuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import unicodedata
+import math
+import sqlite3
+import sys
+import gzip
+import urllib.parse
+import urllib.request
+from PIL import Image as PILImage, ImageOps
+from markupsafe import Markup, escape
+from jinja2.utils import htmlsafe_json_dumps
+
+try:
+    import brotli  # optional: Brotli compression of dynamic responses
+except ImportError:
+    brotli = None
+
+try:
+    import redis  # optional: search result cache shared by every worker
+except ImportError:
+    redis = None
 
 # Load environment variables
 load_dotenv()
@@ -25,14 +58,123 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Allowed extensions
+class TimedQueuePool(QueuePool):
+    """QueuePool reporting how long each checkout waited for a free connection (see /metrics)"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            record_pool_wait(time.perf_counter() - start)
+
+
+# Connection pool, sized for the threads of one worker process (see gunicorn.conf.py).
+# pool_pre_ping and pool_recycle drop connections the database or a firewall closed.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': TimedQueuePool,
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+    'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '30')),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+}
+if DATABASE_URL in ('sqlite://', 'sqlite:///:memory:'):
+    # In-memory databases live in a single shared connection, there is no pool to size
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+
+# SQLite connection settings, applied by set_sqlite_pragmas on every new connection.
+# WAL lets readers proceed while a writer commits; busy_timeout makes writers wait for
+# each other instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),  # milliseconds
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),  # durable with WAL except on power loss
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),  # bytes
+}
+
+# Apply pending schema migrations automatically in create_app (otherwise run `flask schema upgrade`)
+app.config['AUTO_MIGRATE'] = os.getenv('AUTO_MIGRATE', '0') == '1'
+
+# Compiled templates are cached on disk and shared by every worker process. The cached
+# bytecode gets executed, so by default it lives in Jinja's per-user directory, which
+# Jinja creates with 0700 permissions and refuses to use when owned by someone else
+JINJA_CACHE_DIR = os.getenv('JINJA_CACHE_DIR')
+if JINJA_CACHE_DIR:
+    os.makedirs(JINJA_CACHE_DIR, mode=0o700, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Maximum number of SQL statements a request may run before it is reported.
+# With SQL_QUERY_BUDGET_STRICT=1 (e.g. while testing) going over the budget raises instead.
+app.config['SQL_QUERY_BUDGET'] = int(os.getenv('SQL_QUERY_BUDGET', '20'))
+app.config['SQL_QUERY_BUDGET_STRICT'] = os.getenv('SQL_QUERY_BUDGET_STRICT', '0') == '1'
+
+# Image extensions picked up by build_static_assets; uploads are checked by content instead
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# Requests larger than MAX_CONTENT_LENGTH are refused before being read. Profile images
+# are also limited in bytes and pixels, checked before anything decodes them.
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH_MB', '32')) * 1024 * 1024
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_MB', '10')) * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(40_000_000)))
+PILImage.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Uploaded images are re-encoded in the background: turned upright, EXIF metadata
+# (GPS position, camera) dropped and the longest side limited to IMAGE_MAX_DIMENSION
+IMAGE_MAX_DIMENSION = 2048
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '1'))
+
+# Thumbnail variants served by /image/<infopen>/<size> as (width, height)
+IMAGE_VARIANTS = {
+    'avatar': (80, 80),     # 40x40 search list avatar, doubled for high-DPI screens
+    'preview': (300, 300),  # 150x150 edit page preview, doubled for high-DPI screens
+}
+
+
+# Optimized copies of the images in static/ are written to static/build by
+# build_static_assets, at most this wide (twice the displayed size, for high-DPI screens)
+STATIC_IMAGE_WIDTHS = {
+    'brasao.png': 300,  # 150px institutional logo
+}
+STATIC_IMAGE_DEFAULT_WIDTH = 1200
+app.config['BUILD_ASSETS_ON_STARTUP'] = os.getenv('BUILD_ASSETS_ON_STARTUP', '1') == '1'
+
+# Dynamic text responses at least this large are compressed (gzip, or Brotli when installed)
+COMPRESS_MIN_SIZE = 500
+COMPRESS_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+    'application/javascript', 'text/javascript', 'image/svg+xml',
+}
+
+# /search result pages are cached per filter set and page until user_registration changes.
+# SEARCH_CACHE_BACKEND: local (LRU per process), redis (shared by every worker) or none.
+app.config['SEARCH_CACHE_BACKEND'] = os.getenv('SEARCH_CACHE_BACKEND', 'local')
+app.config['SEARCH_CACHE_URL'] = os.getenv('SEARCH_CACHE_URL', 'redis://localhost:6379/0')
+app.config['SEARCH_CACHE_SIZE'] = int(os.getenv('SEARCH_CACHE_SIZE', '512'))  # entries, local backend
+app.config['SEARCH_CACHE_TTL'] = int(os.getenv('SEARCH_CACHE_TTL', '600'))  # seconds
+
+# Background CSV exports: generated files are kept in EXPORT_DIR and reused until the data changes
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+EXPORT_ARTIFACT_TTL = int(os.getenv('EXPORT_ARTIFACT_TTL', str(24 * 3600)))  # seconds
+
+# Geocoding: lookups are answered from the geocode_cache table and only go to the
+# upstream geocoder on a miss. GEOCODER_UPSTREAM=none keeps everything local.
+app.config['GEOCODER_UPSTREAM'] = os.getenv('GEOCODER_UPSTREAM', 'nominatim')
+app.config['GEOCODER_URL'] = os.getenv('GEOCODER_URL', 'https://nominatim.openstreetmap.org/search')
+app.config['GEOCODER_TIMEOUT'] = float(os.getenv('GEOCODER_TIMEOUT', '5'))
+app.config['GEOCODER_USER_AGENT'] = os.getenv('GEOCODER_USER_AGENT', 'iaap-saidas/1.0')
+app.config['GEOCODE_NEGATIVE_TTL'] = int(os.getenv('GEOCODE_NEGATIVE_TTL', str(24 * 3600)))  # seconds
+
+# Duplicate detection: names at least this similar (trigram Jaccard, 0 to 1) are reported
+app.config['DUPLICATE_NAME_THRESHOLD'] = float(os.getenv('DUPLICATE_NAME_THRESHOLD', '0.7'))
 
 # Load enterprise data
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ENTERPRISE_JSON_PATH = os.path.join(BASE_DIR, 'enterprise.json')
 CITYZEN_JSON_PATH = os.path.join(BASE_DIR, 'cityzen.json')
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(BASE_DIR, 'exports'))
+# Optional offline gazetteer: [{"MUNICIPIO": ..., "BAIRRO": ... (optional), "LATITUDE": ..., "LONGITUDE": ...}]
+GAZETTEER_JSON_PATH = os.getenv('GAZETTEER_PATH', os.path.join(BASE_DIR, 'gazetteer.json'))
 
 
 def load_enterprise_data():
@@ -45,15 +187,108 @@ def load_cityzen_data():
         return json.load(f)
 
 
-def get_unique_municipalities():
-    """Extract unique municipalities from cityzen.json"""
-    cityzen_data = load_cityzen_data()
-    municipalities = list(set([item['MUNICIPIO'] for item in cityzen_data]))
-    return sorted(municipalities)
-
+class ReferenceSnapshot:
+    """One consistent load of enterprise.json and cityzen.json, with its lookup indexes
+    and the pre-rendered form fragments built from them"""
+
+    def __init__(self, enterprise_data, cityzen_data, version):
+        self.version = version
+        self.enterprise_data = enterprise_data
+        self.municipalities = sorted({item['MUNICIPIO'] for item in cityzen_data})
+        # Lookups for auto-filling the forms
+        self.municipio_ueop = {item['MUNICIPIO']: item['UEOP'] for item in cityzen_data}
+        self.cia_ueop = {cia: ueop for ueop, cias in enterprise_data.items() for cia in cias}
+
+        # <option> lists and JSON blobs shared by register, edit and search
+        option_values = {
+            'municipio': self.municipalities,
+            'ueop': list(enterprise_data),
+            'cia': [cia for cias in enterprise_data.values() for cia in cias],
+        }
+        self.option_fragments = {
+            name: ''.join(f'<option value="{escape(value)}">{escape(value)}</option>' for value in values)
+            for name, values in option_values.items()
+        }
+        self.json_fragments = {
+            'enterprise_data': Markup(htmlsafe_json_dumps(enterprise_data, dumps=app.json.dumps)),
+            'municipio_ueop': Markup(htmlsafe_json_dumps(self.municipio_ueop, dumps=app.json.dumps)),
+        }
+
+    def options(self, name, selected=None):
+        """The cached <option> list of a select, with selected marked"""
+        fragment = self.option_fragments[name]
+        if selected:
+            option = f'<option value="{escape(selected)}">'
+            fragment = fragment.replace(option, option[:-1] + ' selected>', 1)
+        return Markup(fragment)
+
+    def json(self, name):
+        """A cached JSON blob, safe to embed in a <script>"""
+        return self.json_fragments[name]
+
+
+class ReferenceData:
+    """enterprise.json and cityzen.json, reloaded whenever the files change on disk
+
+    Readers always get a complete snapshot: a reload builds a new one and swaps
+    it in, and a file that fails to parse keeps the previous data in use.
+    """
+
+    def __init__(self, paths, check_interval=2.0):
+        self.paths = paths
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.next_check = 0.0
+        self.file_stamps = None
+        self.snapshot = None
+        self.reload()
+
+    def stamps(self):
+        return tuple((os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in self.paths)
+
+    def reload(self):
+        with self.lock:
+            self.next_check = time.monotonic() + self.check_interval
+            try:
+                stamps = self.stamps()
+            except OSError as e:
+                if self.snapshot is None:
+                    raise
+                app.logger.error('Dados de referência inacessíveis, mantendo a versão anterior: %s', e)
+                return
+            if stamps == self.file_stamps:
+                return
+            # A broken file is only parsed again once it changes
+            self.file_stamps = stamps
 
-ENTERPRISE_DATA = load_enterprise_data()
-MUNICIPALITIES = get_unique_municipalities()
+            try:
+                data = []
+                for path in self.paths:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data.append(json.load(f))
+                snapshot = ReferenceSnapshot(*data, version=(self.snapshot.version + 1 if self.snapshot else 1))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if self.snapshot is None:
+                    raise
+                app.logger.error('Dados de referência inválidos, mantendo a versão anterior: %s', e)
+            else:
+                self.snapshot = snapshot
+
+    def current(self):
+        """The latest snapshot, checking the files' mtimes at most every check_interval seconds"""
+        if time.monotonic() >= self.next_check:
+            self.reload()
+        return self.snapshot
+
+
+REFERENCE_DATA = ReferenceData(
+    (ENTERPRISE_JSON_PATH, CITYZEN_JSON_PATH),
+    check_interval=float(os.getenv('REFERENCE_DATA_CHECK_INTERVAL', '2')))
+
+
+@app.context_processor
+def inject_reference_data():
+    return {'reference_data': REFERENCE_DATA.current()}
 
 # Initialize database
 db = SQLAlchemy(app)
@@ -66,6 +301,94 @@ def allowed_file(filename):
 def get_current_time_brasilia():
     return datetime.now(ZoneInfo("America/Sao_Paulo"))
 
+
+def fold_search_text(value):
+    """Uppercase and strip accents so that 'João' and 'JOAO' share the same search key"""
+    if not value:
+        return None
+    decomposed = unicodedata.normalize('NFKD', value)
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.upper().split()) or None
+
+
+def escape_like(value):
+    """Escape LIKE wildcards so user input is matched literally (use with escape='\\')"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_coordinate(value, limit):
+    """Coordinate typed as text ('-20.16' or '-20,16') as a float within +/-limit, or None"""
+    if value is None:
+        return None
+    try:
+        coordinate = float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        return None
+    if math.isnan(coordinate) or not -limit <= coordinate <= limit:
+        return None
+    return coordinate
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # cells of about 5 x 5 meters
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        value, value_range = (longitude, lng_range) if even else (latitude, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits <<= 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    """(height, width) in degrees of a geohash cell of the given precision"""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lng_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def only_digits(value):
+    """Keep only the digits of a document number (e.g. CPF '123.456.789-00' -> '12345678900')"""
+    if not value:
+        return None
+    return re.sub(r'\D', '', value) or None
+
+
+# Connecting words left out of name comparisons ('ANA DE SOUZA' is 'ANA SOUZA')
+NAME_PARTICLES = {'DA', 'DAS', 'DE', 'DI', 'DO', 'DOS', 'E'}
+
+
+def name_tokens(nome_busca):
+    return [token for token in (nome_busca or '').split() if token not in NAME_PARTICLES]
+
+
+def name_blocks(nome_busca, municipio):
+    """Blocking keys for duplicate detection: município plus the start of the first and of the last name
+
+    Two spellings of a name land in the same block as long as either end of
+    the name starts the same way, so only rows sharing a block are compared.
+    """
+    tokens = name_tokens(nome_busca)
+    if not tokens:
+        return None, None
+    prefix = fold_search_text(municipio) or ''
+    return f'{prefix}:{tokens[0][:4]}', f'{prefix}:{tokens[-1][:4]}' if len(tokens) > 1 else None
+
 # Define models here to avoid circular imports
 
 
@@ -86,8 +409,30 @@ class UserRegistration(db.Model):
     observacoes = db.Column(db.Text, nullable=True)  # Added observacoes field
     latitude = db.Column(db.String(20), nullable=True)  # Latitude field
     longitude = db.Column(db.String(20), nullable=True)  # Longitude field
+    # Numeric copies of latitude/longitude for geographic queries, kept in sync on write
+    latitude_num = db.Column(db.Float, nullable=True)
+    longitude_num = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)
     data_modificacao = db.Column(
         db.DateTime, default=get_current_time_brasilia, onupdate=get_current_time_brasilia)
+    # Accent-folded search keys, kept up to date by uppercase_text_fields
+    nome_busca = db.Column(db.String(200), nullable=True)
+    cpf_busca = db.Column(db.String(14), nullable=True)  # CPF digits only
+    # Duplicate detection blocks (see name_blocks), kept up to date by uppercase_text_fields
+    bloco_nome = db.Column(db.String(110), nullable=True, index=True)
+    bloco_sobrenome = db.Column(db.String(110), nullable=True, index=True)
+
+    __table_args__ = (
+        # Sort key of the keyset pagination in /search
+        db.Index('ix_user_registration_nome_completo_id', 'nome_completo', 'id'),
+        # Filter combinations of /search and /export_csv (see `flask check-query-plans`)
+        db.Index('ix_user_registration_ueop_cia_data', 'ueop', 'cia', 'data_modificacao'),
+        db.Index('ix_user_registration_cia_data', 'cia', 'data_modificacao'),
+        db.Index('ix_user_registration_municipio_data', 'municipio', 'data_modificacao'),
+        db.Index('ix_user_registration_data_modificacao', 'data_modificacao'),
+        # Exact CPF matches in duplicate detection, whatever the typed formatting
+        db.Index('ix_user_registration_cpf_busca', 'cpf_busca'),
+    )
 
     def __repr__(self):
         return f'<UserRegistration {self.nome_completo}>'
@@ -97,12 +442,12 @@ class Images(db.Model):
     __tablename__ = 'images'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     # Foreign key relationship with user_registration.infopen
-    infopen = db.Column(db.String(100), db.ForeignKey('user_registration.infopen'), nullable=False)
-    # Store Base64 encoded image
-    image_b64 = db.Column(db.Text, nullable=False)
+    infopen = db.Column(db.String(100), db.ForeignKey('user_registration.infopen'), nullable=False, index=True)
+    # Legacy Base64 encoded image - empty once the bytes live in image_blobs
+    image_b64 = db.Column(db.Text, nullable=False, default='')
     # Optional fields for profile image and image hash
     imagem_perfil = db.Column(db.String(200), nullable=True)  # Added for consistency with old field
-    image_hash = db.Column(db.String(64), nullable=True)  # SHA256 hash of the image
+    image_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA256 of the image, key into image_blobs
     # Optional datetime field
     created_at = db.Column(db.DateTime, default=get_current_time_brasilia)
 
@@ -110,108 +455,1487 @@ class Images(db.Model):
         return f'<Images {self.infopen}>'
 
 
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blobs'
+    # Content-addressed storage: one row per distinct image, keyed by its SHA256
+    image_hash = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)  # Raw image bytes
+    mimetype = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # Size in bytes
+    created_at = db.Column(db.DateTime, default=get_current_time_brasilia)
+    # Hash of the upload this blob was re-encoded from (see process_image_blob);
+    # None while the blob still holds the bytes as uploaded
+    source_hash = db.Column(db.String(64), nullable=True, index=True)
+
+    def __repr__(self):
+        return f'<ImageBlob {self.image_hash}>'
+
+
+class ImageVariant(db.Model):
+    __tablename__ = 'image_variants'
+    # Resized copy of an image_blobs entry, one row per (original hash, size name)
+    image_hash = db.Column(db.String(64), primary_key=True)
+    size_name = db.Column(db.String(20), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    mimetype = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=get_current_time_brasilia)
+
+    def __repr__(self):
+        return f'<ImageVariant {self.image_hash} {self.size_name}>'
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    # Write counter per table, bumped in the same transaction as each change.
+    # Caches store the version they were built from and are stale once it moves.
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name}={self.version}>'
+
+
+# Tables whose changes are tracked in data_versions
+DATA_VERSION_NAMES = ('user_registration', 'judiciary')
+
+
 class Judiciary(db.Model):
     __tablename__ = 'judiciary'
     id = db.Column(db.Integer, primary_key=True)
-    infopen = db.Column(db.String(100), db.ForeignKey('user_registration.infopen'), nullable=False)
+    infopen = db.Column(db.String(100), db.ForeignKey('user_registration.infopen'), nullable=False, index=True)
     data_notificacao = db.Column(db.Date, nullable=True)  # Data da Notificação
-    numero_seeu = db.Column(db.String(100), nullable=True)  # Número do SEEU
+    numero_seeu = db.Column(db.String(100), nullable=True, index=True)  # Número do SEEU
     protocolo = db.Column(db.String(100), nullable=True)  # Protocolo
     anotacoes = db.Column(db.Text, nullable=True)  # Anotações
     data_registro = db.Column(db.DateTime, default=get_current_time_brasilia, onupdate=get_current_time_brasilia)
 
+    __table_args__ = (
+        # Sort key of the keyset pagination in /seeu
+        db.Index('ix_judiciary_data_registro_id', 'data_registro', 'id'),
+    )
+
     def __repr__(self):
         return f'<Judiciary {self.numero_seeu}>'
 
 
-# Create tables only if they don't exist
-with app.app_context():
-    # Check if tables exist, create them if they don't
+class GeocodeCache(db.Model):
+    __tablename__ = 'geocode_cache'
+    # Normalized address -> coordinates. Rows without coordinates remember upstream misses.
+    query_key = db.Column(db.String(300), primary_key=True)
+    address = db.Column(db.String(300), nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    display_name = db.Column(db.String(300), nullable=True)
+    source = db.Column(db.String(20), nullable=False)  # gazetteer, registros or upstream
+    created_at = db.Column(db.DateTime, default=get_current_time_brasilia)
+
+    def __repr__(self):
+        return f'<GeocodeCache {self.query_key}>'
+
+
+class RegistrationSummary(db.Model):
+    __tablename__ = 'registration_summary'
+    # Registrations per UEOP/CIA/município and month of the last change, kept current
+    # by the write hooks (see update_summary). Empty values are stored as ''.
+    ueop = db.Column(db.String(100), primary_key=True)
+    cia = db.Column(db.String(100), primary_key=True)
+    municipio = db.Column(db.String(100), primary_key=True)
+    mes = db.Column(db.String(7), primary_key=True)  # YYYY-MM of data_modificacao
+    total = db.Column(db.Integer, nullable=False, default=0)
+    com_seeu = db.Column(db.Integer, nullable=False, default=0)  # with at least one SEEU record
+
+    def __repr__(self):
+        return f'<RegistrationSummary {self.ueop}/{self.cia}/{self.municipio}/{self.mes}={self.total}>'
+
+
+class JudiciarySummary(db.Model):
+    __tablename__ = 'judiciary_summary'
+    # SEEU records per month of notification ('' when the date is missing)
+    mes = db.Column(db.String(7), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<JudiciarySummary {self.mes}={self.total}>'
+
+
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    # Append-only record of every registration and SEEU change, written in the same
+    # transaction as the change and served by /api/changes in (txid, id) order
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(30), nullable=False)  # 'user_registration' or 'judiciary'
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # insert, update or delete
+    data = db.Column(db.Text, nullable=True)  # JSON of the row after the change; keys only for deletes
+    changed_at = db.Column(db.DateTime, nullable=False, default=get_current_time_brasilia)
+    # PostgreSQL transaction id (0 elsewhere): ids are handed out before commit, so entries
+    # are read by transaction and only once no older transaction is still in progress
+    txid = db.Column(db.BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_change_log_txid_id', 'txid', 'id'),
+        # Never reuse the ids of removed rows: they are part of the consumers' cursors
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f'<ChangeLog {self.id} {self.operation} {self.entity}/{self.entity_id}>'
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    # One row per numbered migration applied by `flask schema upgrade`
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=get_current_time_brasilia)
+
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}>'
+
+
+# Numbered schema migrations, applied in order by `flask schema upgrade`.
+# Each one must also cope with databases created before migrations were tracked.
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def get_column_names(table_name):
     from sqlalchemy import inspect
-    inspector = inspect(db.engine)
-    table_names = inspector.get_table_names()
+    return {column['name'] for column in inspect(db.session.connection()).get_columns(table_name)}
+
+
+def add_missing_column(table_name, column_name, column_type):
+    if column_name not in get_column_names(table_name):
+        db.session.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+
+
+def create_missing_tables(*models):
+    db.metadata.create_all(bind=db.session.connection(), tables=[model.__table__ for model in models])
+
+
+def create_missing_index(model, index_name):
+    """Create one of the indexes declared on model, if the database doesn't have it yet"""
+    index = next(index for index in model.__table__.indexes if index.name == index_name)
+    index.create(db.session.connection(), checkfirst=True)
+
+
+def create_search_index():
+    """Create the text index behind search_filter for the current database"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        index_exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'user_registration_fts'")).first()
+
+        # Trigram FTS5 index over the folded keys, synced by triggers so every writer keeps it current
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS user_registration_fts USING fts5("
+            "nome_busca, infopen, cpf_busca, "
+            "content='user_registration', content_rowid='id', tokenize='trigram')"))
+        db.session.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS user_registration_fts_insert AFTER INSERT ON user_registration BEGIN "
+            "INSERT INTO user_registration_fts(rowid, nome_busca, infopen, cpf_busca) "
+            "VALUES (new.id, new.nome_busca, new.infopen, new.cpf_busca); END"))
+        db.session.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS user_registration_fts_delete AFTER DELETE ON user_registration BEGIN "
+            "INSERT INTO user_registration_fts(user_registration_fts, rowid, nome_busca, infopen, cpf_busca) "
+            "VALUES ('delete', old.id, old.nome_busca, old.infopen, old.cpf_busca); END"))
+        db.session.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS user_registration_fts_update "
+            "AFTER UPDATE OF nome_busca, infopen, cpf_busca ON user_registration BEGIN "
+            "INSERT INTO user_registration_fts(user_registration_fts, rowid, nome_busca, infopen, cpf_busca) "
+            "VALUES ('delete', old.id, old.nome_busca, old.infopen, old.cpf_busca); "
+            "INSERT INTO user_registration_fts(rowid, nome_busca, infopen, cpf_busca) "
+            "VALUES (new.id, new.nome_busca, new.infopen, new.cpf_busca); END"))
+
+        if not index_exists:
+            # Index the rows that already exist
+            db.session.execute(text(
+                "INSERT INTO user_registration_fts(user_registration_fts) VALUES ('rebuild')"))
+    elif dialect == 'postgresql':
+        # Trigram GIN indexes make LIKE '%term%' an index lookup instead of a table scan
+        db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in ('nome_busca', 'infopen', 'cpf_busca'):
+            db.session.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_user_registration_{column}_trgm "
+                f"ON user_registration USING gin ({column} gin_trgm_ops)"))
+
+
+def derive_coordinates(latitude, longitude):
+    """(latitude_num, longitude_num, geohash) for coordinates typed as text; Nones if invalid"""
+    latitude_num = parse_coordinate(latitude, 90)
+    longitude_num = parse_coordinate(longitude, 180)
+    if latitude_num is None or longitude_num is None:
+        return None, None, None
+    return latitude_num, longitude_num, geohash_encode(latitude_num, longitude_num)
+
+
+def create_geo_index():
+    """Create the spatial index behind find_in_bbox for the current database"""
+    if db.engine.dialect.name != 'sqlite':
+        # Other databases search by geohash prefix ranges (indexed column, see geohash_prefixes)
+        return
+
+    # R*Tree over the numeric coordinates, synced by triggers so every writer keeps it current
+    db.session.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS user_registration_geo USING rtree("
+        "id, min_lat, max_lat, min_lng, max_lng)"))
+    db.session.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS user_registration_geo_insert AFTER INSERT ON user_registration "
+        "WHEN new.latitude_num IS NOT NULL AND new.longitude_num IS NOT NULL BEGIN "
+        "INSERT INTO user_registration_geo VALUES "
+        "(new.id, new.latitude_num, new.latitude_num, new.longitude_num, new.longitude_num); END"))
+    db.session.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS user_registration_geo_update "
+        "AFTER UPDATE OF latitude_num, longitude_num ON user_registration BEGIN "
+        "DELETE FROM user_registration_geo WHERE id = old.id; "
+        "INSERT INTO user_registration_geo "
+        "SELECT new.id, new.latitude_num, new.latitude_num, new.longitude_num, new.longitude_num "
+        "WHERE new.latitude_num IS NOT NULL AND new.longitude_num IS NOT NULL; END"))
+    db.session.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS user_registration_geo_delete AFTER DELETE ON user_registration BEGIN "
+        "DELETE FROM user_registration_geo WHERE id = old.id; END"))
+
+    # Index the rows that already have coordinates
+    db.session.execute(text("DELETE FROM user_registration_geo"))
+    db.session.execute(text(
+        "INSERT INTO user_registration_geo "
+        "SELECT id, latitude_num, latitude_num, longitude_num, longitude_num FROM user_registration "
+        "WHERE latitude_num IS NOT NULL AND longitude_num IS NOT NULL"))
+
+
+def backfill_coordinates(batch_size=1000):
+    """Parse the text coordinates of rows written before the numeric columns existed"""
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, latitude, longitude FROM user_registration "
+            "WHERE id > :last_id AND latitude IS NOT NULL AND longitude IS NOT NULL "
+            "ORDER BY id LIMIT :batch_size"), {'last_id': last_id, 'batch_size': batch_size}).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            latitude_num, longitude_num, geohash = derive_coordinates(row.latitude, row.longitude)
+            if geohash:
+                updates.append({'id': row.id, 'latitude_num': latitude_num,
+                                'longitude_num': longitude_num, 'geohash': geohash})
+        if updates:
+            db.session.execute(text(
+                "UPDATE user_registration SET latitude_num = :latitude_num, "
+                "longitude_num = :longitude_num, geohash = :geohash WHERE id = :id"), updates)
+        last_id = rows[-1].id
+
+
+def backfill_name_blocks(batch_size=1000):
+    """Fill the duplicate detection blocks of rows written before they existed"""
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, nome_completo, municipio FROM user_registration "
+            "WHERE id > :last_id AND bloco_nome IS NULL ORDER BY id LIMIT :batch_size"),
+            {'last_id': last_id, 'batch_size': batch_size}).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            bloco_nome, bloco_sobrenome = name_blocks(fold_search_text(row.nome_completo), row.municipio)
+            if bloco_nome:
+                updates.append({'id': row.id, 'bloco_nome': bloco_nome, 'bloco_sobrenome': bloco_sobrenome})
+        if updates:
+            db.session.execute(text(
+                "UPDATE user_registration SET bloco_nome = :bloco_nome, bloco_sobrenome = :bloco_sobrenome "
+                "WHERE id = :id"), updates)
+        last_id = rows[-1].id
+
+
+def backfill_search_keys():
+    """Fill the folded search keys of rows written before they existed"""
+    rows = db.session.execute(text(
+        "SELECT id, nome_completo, cpf FROM user_registration WHERE nome_busca IS NULL")).fetchall()
+    if rows:
+        db.session.execute(
+            text("UPDATE user_registration SET nome_busca = :nome_busca, cpf_busca = :cpf_busca WHERE id = :id"),
+            [{'id': row.id, 'nome_busca': fold_search_text(row.nome_completo), 'cpf_busca': only_digits(row.cpf)}
+             for row in rows])
+
+
+@migration(1, 'Tabelas base e colunas legadas')
+def migration_base_tables():
+    create_missing_tables(UserRegistration, Images, Judiciary)
+
+    # Columns added to images after the first release
+    add_missing_column('images', 'imagem_perfil', 'VARCHAR(200)')
+    add_missing_column('images', 'image_hash', 'VARCHAR(64)')
+
+    # Columns added to user_registration after the first release
+    add_missing_column('user_registration', 'latitude', 'VARCHAR(20)')
+    add_missing_column('user_registration', 'longitude', 'VARCHAR(20)')
+    add_missing_column('user_registration', 'telefone', 'VARCHAR(20)')
+    add_missing_column('user_registration', 'observacoes', 'TEXT')
+
+    # Rename logradouro column to bairro if it exists
+    columns = get_column_names('user_registration')
+    if 'bairro' not in columns:
+        db.session.execute(text("ALTER TABLE user_registration ADD COLUMN bairro VARCHAR(200)"))
+        if 'logradouro' in columns:
+            # Copy data from logradouro to bairro; the old column is kept but no longer used
+            db.session.execute(text("UPDATE user_registration SET bairro = logradouro"))
+
+
+@migration(2, 'Armazenamento binário de imagens e miniaturas')
+def migration_image_blobs():
+    create_missing_tables(ImageBlob, ImageVariant)
+    create_missing_index(Images, 'ix_images_infopen')
+
+
+@migration(3, 'Chaves de busca sem acentos e índice de texto')
+def migration_search_index():
+    add_missing_column('user_registration', 'nome_busca', 'VARCHAR(200)')
+    add_missing_column('user_registration', 'cpf_busca', 'VARCHAR(14)')
+    backfill_search_keys()
+    create_search_index()
+
+
+@migration(4, 'Versões dos dados e índice de paginação do /search')
+def migration_data_versions():
+    create_missing_tables(DataVersion)
+    existing = {row.name for row in db.session.execute(text("SELECT name FROM data_versions"))}
+    for name in DATA_VERSION_NAMES:
+        if name not in existing:
+            db.session.add(DataVersion(name=name, version=0))
+    create_missing_index(UserRegistration, 'ix_user_registration_nome_completo_id')
+
+
+@migration(5, 'Índices da tabela judiciary')
+def migration_judiciary_indexes():
+    create_missing_index(Judiciary, 'ix_judiciary_infopen')
+    create_missing_index(Judiciary, 'ix_judiciary_numero_seeu')
+    create_missing_index(Judiciary, 'ix_judiciary_data_registro_id')
+
+
+@migration(6, 'Índices dos filtros de UEOP, CIA, município e data')
+def migration_filter_indexes():
+    create_missing_index(UserRegistration, 'ix_user_registration_ueop_cia_data')
+    create_missing_index(UserRegistration, 'ix_user_registration_cia_data')
+    create_missing_index(UserRegistration, 'ix_user_registration_municipio_data')
+    create_missing_index(UserRegistration, 'ix_user_registration_data_modificacao')
+
+
+@migration(7, 'Coordenadas numéricas e índice espacial')
+def migration_geo_index():
+    add_missing_column('user_registration', 'latitude_num', 'FLOAT')
+    add_missing_column('user_registration', 'longitude_num', 'FLOAT')
+    add_missing_column('user_registration', 'geohash', 'VARCHAR(12)')
+    backfill_coordinates()
+    create_missing_index(UserRegistration, 'ix_user_registration_geohash')
+    create_geo_index()
+
+
+@migration(8, 'Cache de geocodificação')
+def migration_geocode_cache():
+    create_missing_tables(GeocodeCache)
+
+
+@migration(9, 'Tabelas de resumo do painel')
+def migration_summary_tables():
+    create_missing_tables(RegistrationSummary, JudiciarySummary)
+    rebuild_summaries()
+
+
+@migration(10, 'Índices de detecção de egressos duplicados')
+def migration_duplicate_detection():
+    add_missing_column('user_registration', 'bloco_nome', 'VARCHAR(110)')
+    add_missing_column('user_registration', 'bloco_sobrenome', 'VARCHAR(110)')
+    backfill_name_blocks()
+    create_missing_index(UserRegistration, 'ix_user_registration_bloco_nome')
+    create_missing_index(UserRegistration, 'ix_user_registration_bloco_sobrenome')
+    create_missing_index(UserRegistration, 'ix_user_registration_cpf_busca')
+    create_missing_index(Images, 'ix_images_image_hash')
+
+
+@migration(11, 'Origem das imagens reprocessadas')
+def migration_image_source_hash():
+    add_missing_column('image_blobs', 'source_hash', 'VARCHAR(64)')
+    create_missing_index(ImageBlob, 'ix_image_blobs_source_hash')
 
-    if 'images' not in table_names or 'judiciary' not in table_names:  # If images or judiciary table doesn't exist, create all tables
-        db.create_all()
-    else:
-        # Add new columns if they don't exist in user_registration
-        from sqlalchemy import text
-
-        # Remove imagem_perfil and image_hash from user_registration table
-        # Since SQLite doesn't support DROP COLUMN directly, we'll just not use these columns going forward
-        # Add new columns to images table if they don't exist
-        result = db.session.execute(text("PRAGMA table_info(images)"))
-        columns = [row[1] for row in result.fetchall()]
-
-        if 'imagem_perfil' not in columns:
-            db.session.execute(text("ALTER TABLE images ADD COLUMN imagem_perfil VARCHAR(200)"))
-        if 'image_hash' not in columns:
-            db.session.execute(text("ALTER TABLE images ADD COLUMN image_hash VARCHAR(64)"))
-
-        # Also check user_registration table for any other columns that may need to be added
-        result = db.session.execute(text("PRAGMA table_info(user_registration)"))
-        columns = [row[1] for row in result.fetchall()]
-
-        if 'latitude' not in columns:
-            db.session.execute(
-                text("ALTER TABLE user_registration ADD COLUMN latitude VARCHAR(20)"))
-        if 'longitude' not in columns:
-            db.session.execute(
-                text("ALTER TABLE user_registration ADD COLUMN longitude VARCHAR(20)"))
-        if 'telefone' not in columns:
-            db.session.execute(
-                text("ALTER TABLE user_registration ADD COLUMN telefone VARCHAR(20)"))
-        if 'observacoes' not in columns:
-            db.session.execute(
-                text("ALTER TABLE user_registration ADD COLUMN observacoes TEXT"))
-
-        # Rename logradouro column to bairro if it exists
-        if 'logradouro' in columns and 'bairro' not in columns:
-            # Create the new bairro column
-            db.session.execute(
-                text("ALTER TABLE user_registration ADD COLUMN bairro VARCHAR(200)"))
-            # Copy data from logradouro to bairro
-            db.session.execute(
-                text("UPDATE user_registration SET bairro = logradouro"))
-            # Since SQLite doesn't support DROP COLUMN directly, we'll keep both columns
-            # but the application will use the new 'bairro' column going forward
 
+@migration(12, 'Registro de alterações para sincronização')
+def migration_change_log():
+    create_missing_tables(ChangeLog)
+    if db.session.query(ChangeLog.id).first() is None:
+        seed_change_log()
+
+
+def get_schema_version():
+    """Latest applied migration; a single cheap query, 0 if migrations were never applied"""
+    from sqlalchemy.exc import SQLAlchemyError
+    try:
+        return db.session.query(db.func.max(SchemaMigration.version)).scalar() or 0
+    except SQLAlchemyError:
+        db.session.rollback()
+        return 0
+
+
+def get_latest_schema_version():
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+def apply_migrations(log=print):
+    """Apply the pending migrations in order, each one in its own transaction"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    current_version = get_schema_version()
+    for version, description, func in sorted(MIGRATIONS, key=lambda item: item[0]):
+        if version <= current_version:
+            continue
+        log(f'Aplicando migração {version}: {description}')
+        func()
+        db.session.add(SchemaMigration(version=version, description=description))
         db.session.commit()
 
 
+def create_app():
+    """Finish the per-process setup and return the app (WSGI entry point)
+
+    Importing this module never touches the database. This runs one query to
+    check the schema version and compiles every template, so with
+    `gunicorn --preload 'app:create_app()'` it happens once in the master
+    instead of once per forked worker.
+    """
+    if app.config.get('APP_INITIALIZED'):
+        return app
+
+    with app.app_context():
+        pending = get_latest_schema_version() - get_schema_version()
+        if pending > 0:
+            if app.config['AUTO_MIGRATE']:
+                apply_migrations(app.logger.info)
+            else:
+                app.logger.warning('%d migração(ões) pendente(s); execute `flask schema upgrade`.', pending)
+        db.session.remove()
+        # Don't let forked workers inherit the connection used for the check
+        db.engine.dispose()
+
+    if app.config['BUILD_ASSETS_ON_STARTUP']:
+        build_static_assets(app.logger.info)
+    load_asset_manifest()
+
+    # Compile every template up front; forked workers inherit them and the
+    # bytecode cache makes the next boot skip the Jinja compiler altogether
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+    app.config['APP_INITIALIZED'] = True
+    return app
+
+
+schema_cli = AppGroup('schema', help='Gerencia as migrações do banco de dados.')
+app.cli.add_command(schema_cli)
+
+
+@schema_cli.command('upgrade')
+def schema_upgrade():
+    """Apply pending migrations"""
+    apply_migrations(click.echo)
+    click.echo(f'Banco de dados na versão {get_schema_version()}.')
+
+
+@schema_cli.command('status')
+def schema_status():
+    """Show the current and latest schema versions"""
+    click.echo(f'Versão atual: {get_schema_version()}')
+    click.echo(f'Versão mais recente: {get_latest_schema_version()}')
+
+
+# UserRegistration fields filled in by users, in form order
+REGISTRATION_INPUT_FIELDS = (
+    'infopen', 'nome_completo', 'cpf', 'telefone', 'rua', 'bairro', 'numero', 'municipio',
+    'ueop', 'cia', 'restricoes_judiciais', 'observacoes', 'latitude', 'longitude'
+)
+# Coordinates keep the case they were typed in
+UPPERCASE_FIELDS = REGISTRATION_INPUT_FIELDS[:-2]
+
+
+def normalize_registration(values):
+    """Normalize the input fields of a registration, given and returned as a dict
+
+    Uppercases the text fields and derives the search keys and numeric coordinates.
+    Shared by the ORM listener below and the bulk import, which bypasses it.
+    """
+    for field in UPPERCASE_FIELDS:
+        if values.get(field):
+            values[field] = values[field].upper()
+
+    # Keep the accent-folded search keys in sync with the displayed values
+    values['nome_busca'] = fold_search_text(values.get('nome_completo'))
+    values['cpf_busca'] = only_digits(values.get('cpf'))
+    values['bloco_nome'], values['bloco_sobrenome'] = name_blocks(values['nome_busca'], values.get('municipio'))
+
+    # Keep the numeric coordinates in sync with the typed ones
+    values['latitude_num'], values['longitude_num'], values['geohash'] = derive_coordinates(
+        values.get('latitude'), values.get('longitude'))
+    return values
+
+
 # SQLAlchemy event listeners to convert text fields to uppercase before insert/update
 @event.listens_for(UserRegistration, 'before_insert')
 @event.listens_for(UserRegistration, 'before_update')
 def uppercase_text_fields(mapper, connection, target):
-    # Convert all text fields to uppercase
-    if target.infopen:
-        target.infopen = target.infopen.upper()
-    if target.nome_completo:
-        target.nome_completo = target.nome_completo.upper()
-    if target.cpf:
-        target.cpf = target.cpf.upper()
-    if target.telefone:
-        target.telefone = target.telefone.upper()
-    if target.rua:
-        target.rua = target.rua.upper()
-    if target.bairro:
-        target.bairro = target.bairro.upper()
-    if target.numero:
-        target.numero = target.numero.upper()
-    if target.municipio:
-        target.municipio = target.municipio.upper()
-    if target.ueop:
-        target.ueop = target.ueop.upper()
-    if target.cia:
-        target.cia = target.cia.upper()
-    if target.restricoes_judiciais:
-        target.restricoes_judiciais = target.restricoes_judiciais.upper()
-    if target.observacoes:
-        target.observacoes = target.observacoes.upper()
-    if target.latitude:
-        target.latitude = target.latitude.upper()
-    if target.longitude:
-        target.longitude = target.longitude.upper()
+    values = normalize_registration({field: getattr(target, field) for field in REGISTRATION_INPUT_FIELDS})
+    for field, value in values.items():
+        setattr(target, field, value)
+
+
+@event.listens_for(UserRegistration, 'after_insert')
+@event.listens_for(UserRegistration, 'after_update')
+@event.listens_for(UserRegistration, 'after_delete')
+@event.listens_for(Images, 'after_insert')
+@event.listens_for(Images, 'after_update')
+@event.listens_for(Images, 'after_delete')
+def bump_user_registration_version(mapper, connection, target):
+    bump_data_version(connection, 'user_registration')
+
+
+@event.listens_for(Judiciary, 'after_insert')
+@event.listens_for(Judiciary, 'after_update')
+@event.listens_for(Judiciary, 'after_delete')
+def bump_judiciary_version(mapper, connection, target):
+    bump_data_version(connection, 'judiciary')
+
+
+def summary_month(value):
+    return value.strftime('%Y-%m') if value else ''
+
+
+def registration_summary_key(values):
+    """(ueop, cia, municipio, mes) group of a registration given as {column: value}"""
+    return (values.get('ueop') or '', values.get('cia') or '', values.get('municipio') or '',
+            summary_month(values.get('data_modificacao')))
+
+
+def previous_values(target, fields):
+    """Values of fields as they were loaded from the database, before pending changes"""
+    state = db.inspect(target)
+    values = {}
+    for field in fields:
+        history = state.attrs[field].history
+        values[field] = history.deleted[0] if history.deleted else getattr(target, field)
+    return values
+
+
+def update_summary(connection, table, key, **deltas):
+    """Add deltas to the counters of one summary row, creating or dropping the row as needed"""
+    key_values = dict(zip([column.name for column in table.primary_key.columns], key))
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(**key_values, **{name: max(delta, 0) for name, delta in deltas.items()})
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=list(key_values),
+        set_={name: table.c[name] + delta for name, delta in deltas.items()}))
+
+    if any(delta < 0 for delta in deltas.values()):
+        counters = [table.c[name] for name in table.columns.keys() if name not in key_values]
+        connection.execute(table.delete().where(
+            *[table.c[name] == value for name, value in key_values.items()],
+            *[counter <= 0 for counter in counters]))
+
+
+def has_seeu_records(connection, infopen):
+    judiciary = Judiciary.__table__
+    return connection.execute(
+        db.select(db.func.count()).select_from(judiciary).where(judiciary.c.infopen == infopen)
+    ).scalar() > 0
+
+
+SUMMARY_FIELDS = ('ueop', 'cia', 'municipio', 'data_modificacao', 'infopen')
+
+
+@event.listens_for(UserRegistration, 'before_update')
+def remember_registration_summary_key(mapper, connection, target):
+    target._previous_summary_values = previous_values(target, SUMMARY_FIELDS)
+
+
+@event.listens_for(UserRegistration, 'after_insert')
+def count_inserted_registration(mapper, connection, target):
+    values = {field: getattr(target, field) for field in SUMMARY_FIELDS}
+    update_summary(connection, RegistrationSummary.__table__, registration_summary_key(values), total=1,
+                   com_seeu=int(has_seeu_records(connection, target.infopen)))
+
+
+@event.listens_for(UserRegistration, 'after_update')
+def move_updated_registration(mapper, connection, target):
+    before = target.__dict__.pop('_previous_summary_values', None)
+    if before is None:
+        return
+    after = {field: getattr(target, field) for field in SUMMARY_FIELDS}
+    old_key, new_key = registration_summary_key(before), registration_summary_key(after)
+    old_seeu = int(has_seeu_records(connection, before['infopen']))
+    new_seeu = int(has_seeu_records(connection, after['infopen']))
+    if old_key != new_key or old_seeu != new_seeu:
+        update_summary(connection, RegistrationSummary.__table__, old_key, total=-1, com_seeu=-old_seeu)
+        update_summary(connection, RegistrationSummary.__table__, new_key, total=1, com_seeu=new_seeu)
+
+
+@event.listens_for(UserRegistration, 'after_delete')
+def count_deleted_registration(mapper, connection, target):
+    values = previous_values(target, SUMMARY_FIELDS)
+    update_summary(connection, RegistrationSummary.__table__, registration_summary_key(values), total=-1,
+                   com_seeu=-int(has_seeu_records(connection, values['infopen'])))
+
+
+def count_seeu_change(connection, infopen, delta):
+    """Keep com_seeu right when an egresso gets its first SEEU record or loses the last one"""
+    registration = UserRegistration.__table__
+    remaining = connection.execute(
+        db.select(db.func.count()).select_from(Judiciary.__table__).where(Judiciary.__table__.c.infopen == infopen)
+    ).scalar()
+    if remaining != (1 if delta > 0 else 0):
+        return
+    row = connection.execute(
+        db.select(*[registration.c[field] for field in SUMMARY_FIELDS]).where(registration.c.infopen == infopen)
+    ).mappings().first()
+    if row:
+        update_summary(connection, RegistrationSummary.__table__, registration_summary_key(row), com_seeu=delta)
+
+
+@event.listens_for(Judiciary, 'before_update')
+def remember_judiciary_summary_key(mapper, connection, target):
+    target._previous_summary_values = previous_values(target, ('data_notificacao', 'infopen'))
+
+
+@event.listens_for(Judiciary, 'after_insert')
+def count_inserted_judiciary(mapper, connection, target):
+    update_summary(connection, JudiciarySummary.__table__, (summary_month(target.data_notificacao),), total=1)
+    count_seeu_change(connection, target.infopen, 1)
+
+
+@event.listens_for(Judiciary, 'after_update')
+def move_updated_judiciary(mapper, connection, target):
+    before = target.__dict__.pop('_previous_summary_values', None)
+    if before is None:
+        return
+    old_month, new_month = summary_month(before['data_notificacao']), summary_month(target.data_notificacao)
+    if old_month != new_month:
+        update_summary(connection, JudiciarySummary.__table__, (old_month,), total=-1)
+        update_summary(connection, JudiciarySummary.__table__, (new_month,), total=1)
+    if before['infopen'] != target.infopen:
+        count_seeu_change(connection, before['infopen'], -1)
+        count_seeu_change(connection, target.infopen, 1)
+
+
+@event.listens_for(Judiciary, 'after_delete')
+def count_deleted_judiciary(mapper, connection, target):
+    values = previous_values(target, ('data_notificacao', 'infopen'))
+    update_summary(connection, JudiciarySummary.__table__, (summary_month(values['data_notificacao']),), total=-1)
+    count_seeu_change(connection, values['infopen'], -1)
+
+
+# Columns published by the change feed for each entity (photos are served by /image/<infopen>)
+CHANGE_FEED_FIELDS = {
+    'user_registration': REGISTRATION_INPUT_FIELDS + ('data_modificacao',),
+    'judiciary': ('infopen', 'data_notificacao', 'numero_seeu', 'protocolo', 'anotacoes', 'data_registro'),
+}
+
+
+def change_data(entity, values):
+    """JSON of the published columns of a row given as {column: value}"""
+    return json.dumps({
+        field: value.isoformat() if hasattr(value, 'isoformat') else value
+        for field, value in ((field, values.get(field)) for field in CHANGE_FEED_FIELDS[entity])
+    }, ensure_ascii=False)
+
+
+def log_changes(connection, entity, operation, entries):
+    """Append (entity_id, data) entries to the change log, inside the writing transaction"""
+    txid = db.func.txid_current() if connection.dialect.name == 'postgresql' else 0
+    connection.execute(ChangeLog.__table__.insert().values(txid=txid), [
+        {'entity': entity, 'entity_id': entity_id, 'operation': operation, 'data': data,
+         'changed_at': get_current_time_brasilia()}
+        for entity_id, data in entries
+    ])
+
+
+@event.listens_for(UserRegistration, 'after_insert')
+@event.listens_for(Judiciary, 'after_insert')
+def log_inserted_row(mapper, connection, target):
+    entity = mapper.local_table.name
+    log_changes(connection, entity, 'insert', [(target.id, change_data(entity, target.__dict__))])
+
+
+@event.listens_for(UserRegistration, 'after_update')
+@event.listens_for(Judiciary, 'after_update')
+def log_updated_row(mapper, connection, target):
+    entity = mapper.local_table.name
+    state = db.inspect(target)
+    # after_update also fires for objects that were only marked dirty
+    if not any(state.attrs[field].history.has_changes() for field in CHANGE_FEED_FIELDS[entity]):
+        return
+    log_changes(connection, entity, 'update', [(target.id, change_data(entity, target.__dict__))])
+
+
+@event.listens_for(UserRegistration, 'after_delete')
+@event.listens_for(Judiciary, 'after_delete')
+def log_deleted_row(mapper, connection, target):
+    # Tombstone: consumers only need to know which row is gone
+    values = previous_values(target, ('infopen',))
+    log_changes(connection, mapper.local_table.name, 'delete',
+                [(target.id, json.dumps({'infopen': values['infopen']}, ensure_ascii=False))])
+
+
+def log_inserted_registrations(connection, rows):
+    """Log bulk inserted registrations (Core inserts skip the hooks above), looking their ids up by infopen"""
+    registration = UserRegistration.__table__
+    columns = [registration.c[field] for field in CHANGE_FEED_FIELDS['user_registration']]
+    saved = connection.execute(db.select(registration.c.id, *columns).where(
+        registration.c.infopen.in_([row['infopen'] for row in rows])).order_by(registration.c.id))
+    log_changes(connection, 'user_registration', 'insert',
+                [(row.id, change_data('user_registration', row._mapping)) for row in saved])
+
+
+def seed_change_log(batch_size=1000):
+    """Log the rows that exist already as inserts, so a consumer starting at cursor 0 gets everything"""
+    connection = db.session.connection()
+    for model in (UserRegistration, Judiciary):
+        table = model.__table__
+        entity = table.name
+        columns = [table.c[field] for field in CHANGE_FEED_FIELDS[entity]]
+        last_id = 0
+        while True:
+            rows = connection.execute(db.select(table.c.id, *columns).where(table.c.id > last_id)
+                                      .order_by(table.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            log_changes(connection, entity, 'insert', [(row.id, change_data(entity, row._mapping)) for row in rows])
+            last_id = rows[-1].id
+
+
+def add_registrations_to_summary(connection, rows):
+    """Count bulk inserted registrations (Core inserts skip the hooks above), checking SEEU with one query"""
+    judiciary = Judiciary.__table__
+    infopens = {row['infopen'] for row in rows if row.get('infopen')}
+    with_seeu = set(connection.execute(
+        db.select(judiciary.c.infopen).where(judiciary.c.infopen.in_(infopens)).distinct()
+    ).scalars()) if infopens else set()
+
+    counts = {}
+    for row in rows:
+        key = registration_summary_key(row)
+        total, com_seeu = counts.get(key, (0, 0))
+        counts[key] = (total + 1, com_seeu + (row.get('infopen') in with_seeu))
+    for key, (total, com_seeu) in counts.items():
+        update_summary(connection, RegistrationSummary.__table__, key, total=total, com_seeu=com_seeu)
+
+
+def month_expression(column):
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.coalesce(db.func.to_char(column, 'YYYY-MM'), '')
+    return db.func.coalesce(db.func.strftime('%Y-%m', column), '')
+
+
+def rebuild_summaries():
+    """Recompute the summary tables from scratch, e.g. after bulk loads or to reconcile drift"""
+    registration = UserRegistration.__table__
+    judiciary = Judiciary.__table__
+    has_seeu = db.exists().where(judiciary.c.infopen == registration.c.infopen)
+    group_columns = [
+        db.func.coalesce(registration.c.ueop, ''), db.func.coalesce(registration.c.cia, ''),
+        db.func.coalesce(registration.c.municipio, ''), month_expression(registration.c.data_modificacao),
+    ]
+
+    db.session.execute(RegistrationSummary.__table__.delete())
+    db.session.execute(RegistrationSummary.__table__.insert().from_select(
+        ['ueop', 'cia', 'municipio', 'mes', 'total', 'com_seeu'],
+        db.select(*group_columns, db.func.count(),
+                  db.func.sum(db.case((has_seeu, 1), else_=0))).group_by(*group_columns)))
+
+    notification_month = month_expression(judiciary.c.data_notificacao)
+    db.session.execute(JudiciarySummary.__table__.delete())
+    db.session.execute(JudiciarySummary.__table__.insert().from_select(
+        ['mes', 'total'], db.select(notification_month, db.func.count()).group_by(notification_month)))
+
+
+def bump_data_version(connection, name):
+    """Invalidate the caches built from a table; runs inside the writing transaction"""
+    version_table = DataVersion.__table__
+    connection.execute(
+        version_table.update()
+        .where(version_table.c.name == name)
+        .values(version=version_table.c.version + 1))
+
+
+def get_data_version(name):
+    return db.session.query(DataVersion.version).filter_by(name=name).scalar() or 0
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma} = {value}')
+    cursor.close()
+
+
+# Per-request SQL statement counter and timer, used to catch N+1 query regressions
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with the statement even when it raises
+    context._query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start_time
+    if has_request_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+        g.sql_query_time = g.get('sql_query_time', 0.0) + elapsed
+
+
+def query_budget(max_queries):
+    """Override SQL_QUERY_BUDGET for a single view; None disables the check"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+@app.after_request
+def check_query_budget(response):
+    query_count = g.get('sql_query_count', 0)
+    query_time_ms = g.get('sql_query_time', 0.0) * 1000
+    response.headers['Server-Timing'] = (
+        f'sql;desc="{query_count} queries";dur={query_time_ms:.1f}, '
+        f'tpl;dur={g.get("template_time", 0.0) * 1000:.1f}, pool;dur={g.get("pool_wait_time", 0.0) * 1000:.1f}')
+
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', app.config['SQL_QUERY_BUDGET'])
+    if budget is not None and query_count > budget:
+        message = (f'{request.method} {request.path} ran {query_count} SQL queries '
+                   f'({query_time_ms:.1f} ms), over the budget of {budget}')
+        if app.config['SQL_QUERY_BUDGET_STRICT']:
+            raise AssertionError(message)
+        app.logger.warning(message)
+    return response
+
+
+# Performance metrics, exposed in the Prometheus text format at /metrics.
+# Every worker process keeps its own; scrape each worker (or run one) for exact totals.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+# Opt-in sampling profiler: requests slower than PROFILE_SLOW_REQUEST_MS leave a
+# folded-stacks file (flamegraph.pl, speedscope) in PROFILE_DIR
+app.config['PROFILE_SLOW_REQUEST_MS'] = int(os.getenv('PROFILE_SLOW_REQUEST_MS', '0'))  # 0 = off
+app.config['PROFILE_INTERVAL_MS'] = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name and label values"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.buckets = {}     # name -> bucket upper bounds
+        self.help = {}
+
+    def describe(self, name, help_text, buckets=None):
+        self.help[name] = help_text
+        if buckets:
+            self.buckets[name] = buckets
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+        with self.lock:
+            series = self.histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for index, upper_bound in enumerate(buckets):
+                if value <= upper_bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        """Prometheus text exposition format"""
+        def label_text(labels):
+            if not labels:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in labels)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for name in sorted(self.help):
+            kind = 'histogram' if name in self.buckets else 'counter'
+            lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                lines.extend(f'{name}{label_text(labels)} {value}'
+                             for (metric, labels), value in counters if metric == name)
+                continue
+            for (metric, labels), series in histograms:
+                if metric != name:
+                    continue
+                for upper_bound, count in zip(self.buckets[name], series):
+                    lines.append(f'{name}_bucket{label_text(labels + (("le", upper_bound),))} {count}')
+                lines.append(f'{name}_bucket{label_text(labels + (("le", "+Inf"),))} {series[-1]}')
+                lines.append(f'{name}_sum{label_text(labels)} {series[-2]}')
+                lines.append(f'{name}_count{label_text(labels)} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+METRICS.describe('http_requests_total', 'Requests handled, by endpoint, method and status.')
+METRICS.describe('http_request_duration_seconds', 'Request latency, by endpoint.', LATENCY_BUCKETS)
+METRICS.describe('http_request_time_seconds_total',
+                 'Request time split into sql, template and other, by endpoint.')
+METRICS.describe('http_response_bytes', 'Response body size, by endpoint.', BYTES_BUCKETS)
+METRICS.describe('sql_queries_total', 'SQL statements executed, by endpoint.')
+METRICS.describe('search_cache_requests_total', '/search pages served from the result cache (hit) or queried (miss).')
+METRICS.describe('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.', LATENCY_BUCKETS)
+
+
+def record_pool_wait(seconds):
+    METRICS.observe('db_pool_checkout_wait_seconds', seconds)
+    if has_request_context():
+        g.pool_wait_time = g.get('pool_wait_time', 0.0) + seconds
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault('template_start_time', []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    starts = g.get('template_start_time')
+    if starts:
+        g.template_time = g.get('template_time', 0.0) + time.perf_counter() - starts.pop()
+
+
+class SamplingProfiler:
+    """Samples the stacks of the threads serving requests from a background thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.samples = {}  # thread id -> {folded stack: count}
+        self.thread = None
+
+    def start(self, thread_id):
+        with self.lock:
+            self.samples[thread_id] = {}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+                self.thread.start()
+
+    def stop(self, thread_id):
+        with self.lock:
+            return self.samples.pop(thread_id, {})
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    names = []
+                    while frame is not None:
+                        code = frame.f_code
+                        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    stack = ';'.join(reversed(names))
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+
+PROFILER = SamplingProfiler(app.config['PROFILE_INTERVAL_MS'] / 1000)
+
+
+def write_profile(samples, elapsed):
+    """Save the folded stacks of a slow request for flamegraph.pl or speedscope"""
+    os.makedirs(app.config['PROFILE_DIR'], mode=0o700, exist_ok=True)
+    filename = '{}-{}-{}ms.folded'.format(
+        get_current_time_brasilia().strftime('%Y%m%d%H%M%S%f'), request.endpoint or 'unknown', int(elapsed * 1000))
+    with open(os.path.join(app.config['PROFILE_DIR'], filename), 'w', encoding='utf-8') as f:
+        for stack, count in sorted(samples.items()):
+            f.write(f'{stack} {count}\n')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+    if app.config['PROFILE_SLOW_REQUEST_MS']:
+        PROFILER.start(threading.get_ident())
+
+
+@app.after_request
+def remember_response_size(response):
+    # Streamed responses don't know their size up front
+    g.response_status = response.status_code
+    g.response_bytes = response.content_length
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    start = g.pop('request_start_time', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unknown'
+
+    if app.config['PROFILE_SLOW_REQUEST_MS']:
+        samples = PROFILER.stop(threading.get_ident())
+        if samples and elapsed * 1000 >= app.config['PROFILE_SLOW_REQUEST_MS']:
+            write_profile(samples, elapsed)
+
+    sql_time = g.get('sql_query_time', 0.0)
+    template_time = g.get('template_time', 0.0)
+    status = g.get('response_status', 500 if exc else 200)
+    METRICS.inc('http_requests_total', endpoint=endpoint, method=request.method, status=status)
+    METRICS.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+    METRICS.inc('http_request_time_seconds_total', sql_time, endpoint=endpoint, component='sql')
+    METRICS.inc('http_request_time_seconds_total', template_time, endpoint=endpoint, component='template')
+    METRICS.inc('http_request_time_seconds_total', max(elapsed - sql_time - template_time, 0.0),
+                endpoint=endpoint, component='other')
+    METRICS.inc('sql_queries_total', g.get('sql_query_count', 0), endpoint=endpoint)
+    if g.get('response_bytes') is not None:
+        METRICS.observe('http_response_bytes', g.response_bytes, endpoint=endpoint)
+
+
+@app.route('/metrics')
+def metrics():
+    """Performance metrics of this worker process in the Prometheus text format"""
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+STATIC_BUILD_DIR = os.path.join(app.static_folder, 'build')
+ASSET_MANIFEST_PATH = os.path.join(STATIC_BUILD_DIR, 'manifest.json')
+ASSET_MANIFEST = {}  # source filename -> {'source_hash': ..., format: path under static/}
+
+
+def optimize_static_image(source_path, max_width):
+    """{format: bytes} with a resized, recompressed copy in the source format and in WebP"""
+    import io
+
+    with PILImage.open(source_path) as image:
+        original_size = image.size
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_width, max_width * 10), PILImage.LANCZOS)
+        has_alpha = image.mode in ('RGBA', 'LA', 'P')
+
+        outputs = {}
+        buffer = io.BytesIO()
+        if os.path.splitext(source_path)[1].lower() == '.png':
+            # The PNGs here are logos and coats of arms: a 256-color palette is indistinguishable
+            palette = image if image.mode == 'P' else image.convert('RGBA').quantize(
+                256, method=PILImage.Quantize.FASTOCTREE)
+            palette.save(buffer, 'PNG', optimize=True)
+            outputs['png'] = buffer.getvalue()
+        else:
+            image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+            outputs['jpeg'] = buffer.getvalue()
+
+        buffer = io.BytesIO()
+        image.convert('RGBA' if has_alpha else 'RGB').save(buffer, 'WEBP', quality=85, method=6)
+        outputs['webp'] = buffer.getvalue()
+        resized = image.size != original_size
+
+    # Re-encoding an already optimized file at the same size can make it bigger
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    for image_format in ('png', 'jpeg'):
+        if image_format in outputs and not resized and len(source) <= len(outputs[image_format]):
+            outputs[image_format] = source
+
+    # WebP is only worth offering when it beats the main copy
+    if len(outputs['webp']) >= min(len(data) for image_format, data in outputs.items() if image_format != 'webp'):
+        del outputs['webp']
+    return outputs
+
+
+def build_static_assets(log=print):
+    """Write fingerprinted, optimized copies of the images in static/ and their manifest
+
+    Only images whose content changed since the last build are processed again.
+    """
+    manifest = {}
+    if os.path.exists(ASSET_MANIFEST_PATH):
+        with open(ASSET_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    os.makedirs(STATIC_BUILD_DIR, exist_ok=True)
+    built = 0
+    for filename in sorted(os.listdir(app.static_folder)):
+        source_path = os.path.join(app.static_folder, filename)
+        if not os.path.isfile(source_path) or not allowed_file(filename):
+            continue
+        with open(source_path, 'rb') as f:
+            source_hash = hashlib.sha256(f.read()).hexdigest()
+        entry = manifest.get(filename)
+        if entry and entry['source_hash'] == source_hash and all(
+                os.path.exists(os.path.join(app.static_folder, path))
+                for image_format, path in entry.items() if image_format != 'source_hash'):
+            continue
+
+        stem = os.path.splitext(filename)[0]
+        entry = {'source_hash': source_hash}
+        outputs = optimize_static_image(source_path, STATIC_IMAGE_WIDTHS.get(filename, STATIC_IMAGE_DEFAULT_WIDTH))
+        for image_format, data in outputs.items():
+            extension = 'jpg' if image_format == 'jpeg' else image_format
+            built_name = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}.{extension}'
+            with open(os.path.join(STATIC_BUILD_DIR, built_name), 'wb') as f:
+                f.write(data)
+            entry[image_format] = f'build/{built_name}'
+        manifest[filename] = entry
+        built += 1
+        log(f'Asset {filename}: ' + ', '.join(
+            f'{image_format} {len(data) // 1024} KB' for image_format, data in outputs.items()))
+
+    if built:
+        temp_path = f'{ASSET_MANIFEST_PATH}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, ASSET_MANIFEST_PATH)
+    return manifest
+
+
+def load_asset_manifest():
+    ASSET_MANIFEST.clear()
+    if os.path.exists(ASSET_MANIFEST_PATH):
+        with open(ASSET_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            ASSET_MANIFEST.update(json.load(f))
+
+
+@app.template_global()
+def asset_url(filename, image_format=None):
+    """URL of the optimized, fingerprinted copy of a static file (the original if not built)
+
+    image_format picks an alternative encoding, e.g. 'webp' for a <picture> source.
+    """
+    entry = ASSET_MANIFEST.get(filename, {})
+    path = entry.get(image_format) if image_format else None
+    if path is None:
+        path = next((path for key, path in entry.items() if key not in ('source_hash', 'webp')), filename)
+    return url_for('static', filename=path)
+
+
+@app.after_request
+def compress_response(response):
+    """Cache fingerprinted assets for good and compress text responses per Accept-Encoding"""
+    if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('build/'):
+        # The name changes whenever the content does
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    if (response.direct_passthrough or not response.is_sequence or response.status_code < 200
+            or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding = 'br'
+    elif accepted['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+
+    # Same content, different bytes: the validator can only stay as a weak one
+    etag, is_weak = response.get_etag()
+    if etag and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# Leading bytes of the accepted image formats
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+def sniff_image_mimetype(image_data):
+    """Mimetype of image bytes from their magic number, None if not an accepted format"""
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if image_data.startswith(signature):
+            return mimetype
+    return None
+
+
+def detect_image_mimetype(image_data):
+    # Determine content type based on image data
+    return sniff_image_mimetype(image_data) or 'image/jpeg'  # default
+
+
+class UploadRejected(ValueError):
+    """An uploaded file that isn't an acceptable image; the message is shown to the user"""
+
+
+ImageUpload = namedtuple('ImageUpload', 'data image_hash mimetype')
+
+
+def check_image_dimensions(image_data):
+    """Reject images over MAX_IMAGE_PIXELS from their header; False if the header isn't complete yet"""
+    import io
+
+    try:
+        with PILImage.open(io.BytesIO(image_data)) as image:  # parses the header only
+            width, height = image.size
+    except PILImage.DecompressionBombError:
+        raise UploadRejected('Imagem com resolução muito alta.')
+    except OSError:
+        return False
+    if width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected(f'Imagem com resolução muito alta ({width}x{height}).')
+    return True
+
+
+def read_image_upload(file, chunk_size=64 * 1024):
+    """Read an uploaded image in chunks, hashing as it goes; raises UploadRejected
+
+    The format comes from the magic bytes rather than the file name, and the
+    size and pixel limits are enforced as soon as the data shows them.
+    """
+    import io
+
+    chunk = file.stream.read(chunk_size)
+    mimetype = sniff_image_mimetype(chunk)
+    if mimetype is None:
+        raise UploadRejected('Formato de imagem não suportado. Envie uma foto PNG, JPEG ou GIF.')
+    # The first chunk usually holds the dimensions already
+    dimensions_checked = check_image_dimensions(chunk)
+
+    digest = hashlib.sha256()
+    buffer = io.BytesIO()
+    while chunk:
+        if buffer.tell() + len(chunk) > MAX_IMAGE_BYTES:
+            raise UploadRejected(f'Imagem muito grande. O limite é de {MAX_IMAGE_BYTES // (1024 * 1024)} MB.')
+        digest.update(chunk)
+        buffer.write(chunk)
+        chunk = file.stream.read(chunk_size)
+
+    image_data = buffer.getvalue()
+    if not dimensions_checked and not check_image_dimensions(image_data):
+        raise UploadRejected('Imagem inválida ou corrompida.')
+    return ImageUpload(image_data, digest.hexdigest(), mimetype)
+
+
+def get_or_create_image_blob(file_content, image_hash=None):
+    """Return the blob for these bytes, adding it only if the same content isn't stored yet"""
+    image_hash = image_hash or hashlib.sha256(file_content).hexdigest()
+    blob = db.session.get(ImageBlob, image_hash)
+    if blob is None:
+        blob = ImageBlob(
+            image_hash=image_hash,
+            data=file_content,
+            mimetype=detect_image_mimetype(file_content),
+            size=len(file_content)
+        )
+        db.session.add(blob)
+    return blob
+
+
+def release_image_blob(image_hash):
+    """Delete a blob once no image record references it anymore"""
+    if not image_hash:
+        return
+    still_used = db.session.query(Images.id).filter_by(image_hash=image_hash).first()
+    if not still_used:
+        ImageVariant.query.filter_by(image_hash=image_hash).delete()
+        blob = db.session.get(ImageBlob, image_hash)
+        if blob:
+            db.session.delete(blob)
+
+
+def render_image_variant(file_content, size_name):
+    """Resize image bytes to the named variant, returning (data, mimetype) or None if undecodable"""
+    import io
+
+    width, height = IMAGE_VARIANTS[size_name]
+    try:
+        with PILImage.open(io.BytesIO(file_content)) as source:
+            # Phone photos are often stored sideways with an EXIF orientation flag
+            image = ImageOps.exif_transpose(source)
+            if size_name == 'avatar':
+                # Avatars are shown with object-fit: cover, so crop to fill the square
+                image = ImageOps.fit(image, (width, height), PILImage.LANCZOS)
+            else:
+                image = image.copy()
+                image.thumbnail((width, height), PILImage.LANCZOS)
+            return encode_image(image)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return None
+
+
+def encode_image(image):
+    """(data, mimetype) of a PIL image; no metadata from the source is written"""
+    import io
+
+    output = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Keep transparency for PNG/GIF sources
+        image.save(output, format='PNG', optimize=True)
+        return output.getvalue(), 'image/png'
+    image.convert('RGB').save(output, format='JPEG', quality=85, optimize=True)
+    return output.getvalue(), 'image/jpeg'
+
+
+def reencode_image(file_content):
+    """Image bytes turned upright, without metadata and at most IMAGE_MAX_DIMENSION wide or tall"""
+    import io
+
+    try:
+        with PILImage.open(io.BytesIO(file_content)) as source:
+            image = ImageOps.exif_transpose(source)
+            if image is source:
+                image = source.copy()
+            image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), PILImage.LANCZOS)
+            return encode_image(image)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return None
+
+
+def get_or_create_image_variant(blob, size_name):
+    """Return the stored variant for blob, generating and storing it on first use"""
+    variant = db.session.get(ImageVariant, (blob.image_hash, size_name))
+    if variant is None:
+        rendered = render_image_variant(blob.data, size_name)
+        if rendered is None:
+            return None
+        variant = ImageVariant(
+            image_hash=blob.image_hash,
+            size_name=size_name,
+            data=rendered[0],
+            mimetype=rendered[1]
+        )
+        db.session.add(variant)
+    return variant
+
+
+def store_profile_image(infopen, upload):
+    """Link an upload (see read_image_upload) to infopen, deduplicating identical uploads; returns the hash
+
+    A photo uploaded before reuses its re-encoded blob. New bytes are stored as
+    uploaded and handed to process_image_blob once the session commits.
+    """
+    blob = ImageBlob.query.filter_by(source_hash=upload.image_hash).first()
+    if blob is None:
+        blob = get_or_create_image_blob(upload.data, upload.image_hash)
+        if blob.source_hash is None:
+            db.session.info.setdefault('pending_images', set()).add(blob.image_hash)
+
+    # Reuse the existing image record for this infopen, if any
+    existing_image = Images.query.filter_by(infopen=infopen).first()
+    if existing_image:
+        old_hash = existing_image.image_hash
+        existing_image.image_hash = blob.image_hash
+        existing_image.image_b64 = ''
+        existing_image.created_at = get_current_time_brasilia()
+        if old_hash != blob.image_hash:
+            release_image_blob(old_hash)
+    else:
+        db.session.add(Images(
+            infopen=infopen,
+            image_b64='',
+            imagem_perfil=infopen,  # For consistency
+            image_hash=blob.image_hash
+        ))
+    return blob.image_hash
+
+
+# Re-encoding runs after the response, in a small local pool
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+
+
+@event.listens_for(Session, 'after_commit')
+def queue_pending_images(session):
+    for image_hash in session.info.pop('pending_images', ()):
+        IMAGE_EXECUTOR.submit(process_image_blob, image_hash)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_pending_images(session):
+    session.info.pop('pending_images', None)
+
+
+def process_image_blob(image_hash):
+    """Replace an uploaded image by its re-encoded copy (see reencode_image) and build its thumbnails"""
+    with app.app_context():
+        try:
+            blob = db.session.get(ImageBlob, image_hash)
+            if blob is None or blob.source_hash is not None:
+                return
+            images = Images.query.filter_by(image_hash=image_hash).all()
+            if not images:
+                # Replaced by another upload in the meantime
+                release_image_blob(image_hash)
+                db.session.commit()
+                return
+
+            rendered = reencode_image(blob.data)
+            if rendered is None:
+                app.logger.warning('Imagem %s não pôde ser reprocessada; mantida como enviada.', image_hash)
+                return
+            data, mimetype = rendered
+            processed_hash = hashlib.sha256(data).hexdigest()
+            processed = db.session.get(ImageBlob, processed_hash)
+            if processed is None:
+                processed = ImageBlob(image_hash=processed_hash, data=data, mimetype=mimetype, size=len(data),
+                                      source_hash=image_hash)
+                db.session.add(processed)
+            elif processed is blob:
+                processed.source_hash = image_hash
+
+            # Generate the thumbnails now so the search page never has to resize on demand
+            for size_name in IMAGE_VARIANTS:
+                get_or_create_image_variant(processed, size_name)
+            for image in images:
+                image.image_hash = processed_hash
+            if processed is not blob:
+                release_image_blob(image_hash)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Falha ao reprocessar a imagem %s', image_hash)
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    flash(f"Arquivo muito grande. O limite por envio é de {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB.",
+          'error')
+    return redirect(request.referrer or url_for('register'))
 
 
 @app.route('/')
@@ -224,6 +1948,170 @@ def show_menu():
     return render_template('menu.html', active_page='menu')
 
 
+def dashboard_data():
+    """Counts for the dashboard, read from the summary tables only"""
+    current_month = get_current_time_brasilia().strftime('%Y-%m')
+    summary = RegistrationSummary.__table__
+    counters = [
+        db.func.coalesce(db.func.sum(summary.c.total), 0).label('total'),
+        db.func.coalesce(db.func.sum(summary.c.com_seeu), 0).label('com_seeu'),
+        db.func.coalesce(db.func.sum(db.case((summary.c.mes == current_month, summary.c.total), else_=0)),
+                         0).label('atualizados_mes'),
+    ]
+
+    def grouped(*columns):
+        rows = db.session.execute(db.select(*columns, *counters).group_by(*columns).order_by(*columns))
+        return [(row[0] if len(columns) == 1 else tuple(row[:len(columns)]), row._mapping) for row in rows]
+
+    judiciary_by_month = [(row.mes, row.total) for row in
+                          JudiciarySummary.query.order_by(JudiciarySummary.mes.desc()).limit(13)]
+    return {
+        'current_month': current_month,
+        'totals': db.session.execute(db.select(*counters)).mappings().one(),
+        'by_ueop': grouped(summary.c.ueop),
+        'by_cia': grouped(summary.c.ueop, summary.c.cia),
+        'by_municipio': grouped(summary.c.municipio),
+        'by_month': [tuple(row) for row in db.session.execute(
+            db.select(summary.c.mes, db.func.sum(summary.c.total))
+            .group_by(summary.c.mes).order_by(summary.c.mes.desc()).limit(13))],
+        'judiciary_by_month': judiciary_by_month,
+        'judiciary_total': db.session.query(db.func.coalesce(db.func.sum(JudiciarySummary.total), 0)).scalar(),
+    }
+
+
+@app.route('/dashboard')
+def dashboard():
+    """Registration and SEEU counts by UEOP, CIA, município and month"""
+    return render_template('dashboard.html', active_page='dashboard', show_institutional_content=False,
+                           **dashboard_data())
+
+
+def name_trigrams(nome_busca):
+    """Trigrams of each word of a folded name, padded the way pg_trgm does"""
+    trigrams = set()
+    for token in name_tokens(nome_busca):
+        padded = f'  {token} '
+        trigrams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return trigrams
+
+
+def trigram_similarity(trigrams, other_trigrams):
+    if not trigrams or not other_trigrams:
+        return 0.0
+    return len(trigrams & other_trigrams) / len(trigrams | other_trigrams)
+
+
+def same_cpf(cpf_busca):
+    # Partial CPFs (a few digits typed) would match unrelated people
+    return cpf_busca is not None and len(cpf_busca) == 11
+
+
+DUPLICATE_COLUMNS = (UserRegistration.id, UserRegistration.infopen, UserRegistration.nome_completo,
+                     UserRegistration.municipio)
+DUPLICATE_BLOCK_LIMIT = 500  # rows of a block compared; larger blocks are cut and reported
+# A photo shared by more registrations than this is a placeholder picture, not evidence
+DUPLICATE_PHOTO_LIMIT = 20
+
+
+def find_duplicates(registration, image_hash=None):
+    """Possible duplicates of a saved registration as [(row, motivo, similaridade)]
+
+    Indexed lookups only: same CPF digits, same photo, then similar names among
+    the rows sharing one of its blocks.
+    """
+    others = UserRegistration.id != registration.id
+    found = {}
+    if same_cpf(registration.cpf_busca):
+        for row in db.session.query(*DUPLICATE_COLUMNS).filter(
+                UserRegistration.cpf_busca == registration.cpf_busca, others):
+            found.setdefault(row.id, (row, 'CPF', 1.0))
+    if image_hash:
+        rows = db.session.query(*DUPLICATE_COLUMNS).join(Images, Images.infopen == UserRegistration.infopen).filter(
+            Images.image_hash == image_hash, others).limit(DUPLICATE_PHOTO_LIMIT).all()
+        if len(rows) < DUPLICATE_PHOTO_LIMIT:
+            for row in rows:
+                found.setdefault(row.id, (row, 'Foto', 1.0))
+
+    if registration.bloco_nome:
+        same_block = UserRegistration.bloco_nome == registration.bloco_nome
+        if registration.bloco_sobrenome:
+            same_block = db.or_(same_block, UserRegistration.bloco_sobrenome == registration.bloco_sobrenome)
+        trigrams = name_trigrams(registration.nome_busca)
+        threshold = app.config['DUPLICATE_NAME_THRESHOLD']
+        # Names of about the same length are the likeliest matches, so an oversized block keeps those
+        length_gap = db.func.abs(db.func.length(UserRegistration.nome_busca) - len(registration.nome_busca or ''))
+        rows = db.session.query(*DUPLICATE_COLUMNS, UserRegistration.nome_busca).filter(same_block, others).order_by(
+            length_gap, UserRegistration.id).limit(DUPLICATE_BLOCK_LIMIT + 1).all()
+        if len(rows) > DUPLICATE_BLOCK_LIMIT:
+            app.logger.warning('Blocos %s / %s com mais de %d cadastros; comparados só os de nome de tamanho '
+                               'mais próximo.', registration.bloco_nome, registration.bloco_sobrenome,
+                               DUPLICATE_BLOCK_LIMIT)
+            rows = rows[:DUPLICATE_BLOCK_LIMIT]
+        for row in rows:
+            similarity = trigram_similarity(trigrams, name_trigrams(row.nome_busca))
+            if similarity >= threshold:
+                found.setdefault(row.id, (row, 'Nome', similarity))
+    return list(found.values())
+
+
+def duplicate_report():
+    """Possible duplicates in the table as ([(row, other row, motivo, similaridade)], [(bloco, cadastros)])
+
+    Rows are streamed grouped by CPF, photo hash and name block, so only rows
+    within the same group are ever compared. Name blocks over
+    DUPLICATE_BLOCK_LIMIT rows are cut to their oldest rows and listed second.
+    """
+    from itertools import combinations, groupby, islice
+
+    pairs = {}
+
+    def add_pairs(rows, motivo):
+        for row, other in combinations(rows, 2):
+            pairs.setdefault((min(row.id, other.id), max(row.id, other.id)), (row, other, motivo, 1.0))
+
+    repeated_cpfs = db.session.query(UserRegistration.cpf_busca).filter(
+        db.func.length(UserRegistration.cpf_busca) == 11
+    ).group_by(UserRegistration.cpf_busca).having(db.func.count() > 1)
+    rows = db.session.query(*DUPLICATE_COLUMNS, UserRegistration.cpf_busca).filter(
+        UserRegistration.cpf_busca.in_(repeated_cpfs)).order_by(UserRegistration.cpf_busca)
+    for _, group in groupby(rows, key=lambda row: row.cpf_busca):
+        add_pairs(list(group), 'CPF')
+
+    repeated_hashes = db.session.query(Images.image_hash).filter(Images.image_hash.isnot(None)).group_by(
+        Images.image_hash).having(db.func.count(db.distinct(Images.infopen)).between(2, DUPLICATE_PHOTO_LIMIT))
+    rows = db.session.query(*DUPLICATE_COLUMNS, Images.image_hash).join(
+        Images, Images.infopen == UserRegistration.infopen
+    ).filter(Images.image_hash.in_(repeated_hashes)).order_by(Images.image_hash)
+    for _, group in groupby(rows, key=lambda row: row.image_hash):
+        add_pairs(list(group), 'Foto')
+
+    threshold = app.config['DUPLICATE_NAME_THRESHOLD']
+
+    def add_name_pairs(rows):
+        # Similarity is at most the ratio of the trigram counts, so with the rows sorted by count
+        # each one is only compared with the next ones up to 1 / threshold times its size
+        rows = sorted(((name_trigrams(row.nome_busca), row) for row in rows), key=lambda item: len(item[0]))
+        for index, (trigrams, row) in enumerate(rows):
+            for other_trigrams, other in rows[index + 1:]:
+                if threshold * len(other_trigrams) > len(trigrams):
+                    break
+                key = (min(row.id, other.id), max(row.id, other.id))
+                similarity = trigram_similarity(trigrams, other_trigrams)
+                if key not in pairs and similarity >= threshold:
+                    pairs[key] = (row, other, 'Nome', similarity)
+
+    truncated = []
+    for block_column in (UserRegistration.bloco_nome, UserRegistration.bloco_sobrenome):
+        rows = db.session.query(*DUPLICATE_COLUMNS, UserRegistration.nome_busca, block_column.label('bloco')).filter(
+            block_column.isnot(None)).order_by(block_column, UserRegistration.id).execution_options(yield_per=1000)
+        for block, group in groupby(rows, key=lambda row: row.bloco):
+            add_name_pairs(list(islice(group, DUPLICATE_BLOCK_LIMIT)))
+            skipped = sum(1 for _ in group)
+            if skipped:
+                truncated.append((block, DUPLICATE_BLOCK_LIMIT + skipped))
+    return list(pairs.values()), truncated
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -246,42 +2134,23 @@ def register():
         # Backend validation for infopen field
         if not infopen or not infopen.strip():
             flash('O campo Infopen é obrigatório.', 'error')
-            return render_template('register.html', active_page='register', show_institutional_content=False, enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+            return render_template('register.html', active_page='register', show_institutional_content=False)
 
         # Check if infopen already exists to ensure uniqueness
         existing_user = UserRegistration.query.filter_by(infopen=infopen).first()
         if existing_user:
             flash('Egresso já cadastrado!', 'error')
-            return render_template('register.html', active_page='register', show_institutional_content=False, enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
-
-        # Handle image upload - convert to Base64 and store in images table
-        if 'imagem_perfil' in request.files:
-            file = request.files['imagem_perfil']
-            if file and file.filename != '' and allowed_file(file.filename):
-                # Read the file content
-                file_content = file.read()
-
-                # Calculate the SHA256 hash of the image file
-                image_hash = hashlib.sha256(file_content).hexdigest()
-
-                # Convert the image to Base64
-                image_b64 = base64.b64encode(file_content).decode('utf-8')
-
-                # Store the Base64 image in the images table
-                # First, check if an image already exists for this infopen and delete it
-                existing_image = Images.query.filter_by(
-                    infopen=infopen).first()
-                if existing_image:
-                    db.session.delete(existing_image)
-
-                # Create new image record
-                new_image = Images(
-                    infopen=infopen,
-                    image_b64=image_b64,
-                    imagem_perfil=infopen,  # For consistency
-                    image_hash=image_hash
-                )
-                db.session.add(new_image)
+            return render_template('register.html', active_page='register', show_institutional_content=False)
+
+        # Handle image upload - store the raw bytes in the content-addressed blob store
+        image_hash = None
+        file = request.files.get('imagem_perfil')
+        if file and file.filename != '':
+            try:
+                image_hash = store_profile_image(infopen, read_image_upload(file))
+            except UploadRejected as e:
+                flash(str(e), 'error')
+                return render_template('register.html', active_page='register', show_institutional_content=False)
 
         # Create new user registration
         new_user = UserRegistration(
@@ -305,109 +2174,394 @@ def register():
             db.session.add(new_user)
             db.session.commit()
             flash('Registro salvo com sucesso!', 'success')
+
+            # Same person registered before under another Infopen or CPF formatting
+            duplicates = find_duplicates(new_user, image_hash)
+            if duplicates:
+                listed = '; '.join(f'Infopen {row.infopen} - {row.nome_completo} ({motivo})'
+                                   for row, motivo, _ in duplicates[:5])
+                if len(duplicates) > 5:
+                    listed += f' e mais {len(duplicates) - 5}'
+                flash(f'Possível egresso duplicado: {listed}. Confira os cadastros.', 'warning')
             return redirect(url_for('register'))
         except Exception as e:
             db.session.rollback()
             flash(f'Erro ao salvar o registro: {str(e)}', 'error')
 
     # Prepare enterprise data and municipalities for the template
-    return render_template('register.html', active_page='register', show_institutional_content=False, enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+    return render_template('register.html', active_page='register', show_institutional_content=False)
+
+
+# Searchable UserRegistration fields and the folded column holding their search key
+SEARCH_KEY_COLUMNS = {
+    'infopen': 'infopen',
+    'nome_completo': 'nome_busca',
+    'cpf': 'cpf_busca',
+}
+
+# Lightweight handle on the SQLite FTS5 index created by create_search_index
+user_registration_fts = db.table(
+    'user_registration_fts', db.column('rowid'), db.column('user_registration_fts'))
 
 
-@app.route('/search', methods=['GET', 'POST'])
-def search():
-    # Get page number from request arguments, default to 1
-    page = request.args.get('page', 1, type=int)
-    per_page = 50  # Number of records per page
+def search_filter(field, term):
+    """Accent- and case-insensitive substring filter on infopen, nome_completo or cpf
+
+    Uses the FTS5 trigram index on SQLite and the pg_trgm indexes on PostgreSQL.
+    """
+    column_name = SEARCH_KEY_COLUMNS[field]
+    key = only_digits(term) if field == 'cpf' else fold_search_text(term)
+    if not key:
+        # e.g. a CPF typed without any digit: compare against the stored value as typed
+        return getattr(UserRegistration, field).ilike(f'%{term}%')
+
+    # Trigrams need at least three characters; shorter keys fall back to LIKE
+    if db.engine.dialect.name == 'sqlite' and len(key) >= 3:
+        match = '{}: "{}"'.format(column_name, key.replace('"', '""'))
+        return UserRegistration.id.in_(
+            db.select(user_registration_fts.c.rowid).where(
+                user_registration_fts.c.user_registration_fts.op('MATCH')(match)))
+
+    return getattr(UserRegistration, column_name).like(f'%{escape_like(key)}%', escape='\\')
+
+
+def image_exists_column():
+    """EXISTS projection telling whether a user has a profile image, without loading the image itself"""
+    return db.session.query(Images.id).filter(
+        Images.infopen == UserRegistration.infopen
+    ).exists().label('has_image')
+
+
+# Filters accepted by /search and /export_csv
+SEARCH_FILTER_FIELDS = (
+    'infopen', 'nome_completo', 'cpf', 'municipio', 'ueop', 'cia',
+    'data_modificacao', 'ano_modificacao', 'mes_modificacao'
+)
+
+
+class LocalCacheBackend:
+    """Thread-safe in-process LRU bounded by entry count and, unless ttl is None, by age
+
+    Also the stand-in for RedisCacheBackend in tests.
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expiry, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (expiry, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+# Total counts of recent filter sets as {filters: (data version, total)}
+SEARCH_COUNT_CACHE_SIZE = 256
+SEARCH_COUNT_CACHE = LocalCacheBackend(SEARCH_COUNT_CACHE_SIZE)
+
+
+def get_search_filters(values):
+    """Read the search filters from a form or query string, dropping empty ones"""
+    filters = {}
+    for field in SEARCH_FILTER_FIELDS:
+        value = (values.get(field) or '').strip()
+        if value:
+            filters[field] = value
+    return filters
+
+
+def report_invalid_filter(message):
+    # Export jobs apply the same filters outside of a request, with nowhere to flash to
+    if has_request_context():
+        flash(message, 'error')
+        # The page shown with this message must not be cached, or later hits would skip it
+        g.invalid_search_filter = True
+
+
+def month_range(year, month):
+    """Start of the month and start of the following one"""
+    month_start = datetime(year, month, 1)
+    if month == 12:
+        return month_start, datetime(year + 1, 1, 1)
+    return month_start, datetime(year, month + 1, 1)
+
+
+def apply_search_filters(query, filters):
+    """Apply the /search filters to a query over UserRegistration"""
+    if 'infopen' in filters:
+        query = query.filter(search_filter('infopen', filters['infopen']))
+    if 'nome_completo' in filters:
+        query = query.filter(search_filter('nome_completo', filters['nome_completo']))
+    if 'cpf' in filters:
+        query = query.filter(search_filter('cpf', filters['cpf']))
+    # UEOP, CIA and município come from fixed lists, so they are compared for equality (indexable)
+    if 'municipio' in filters:
+        query = query.filter(UserRegistration.municipio == filters['municipio'].upper())
+    if 'ueop' in filters:
+        query = query.filter(UserRegistration.ueop == filters['ueop'].upper())
+    if 'cia' in filters:
+        query = query.filter(UserRegistration.cia == filters['cia'].upper())
+
+    # Date filters based on data_modificacao, written as half-open ranges on the
+    # raw column so the (..., data_modificacao) indexes can be used
+    data_modificacao = UserRegistration.data_modificacao
+    if 'data_modificacao' in filters:
+        # Parse the date string and filter for that specific date
+        try:
+            day_start = datetime.strptime(filters['data_modificacao'], '%Y-%m-%d')
+            query = query.filter(data_modificacao >= day_start,
+                                 data_modificacao < day_start + timedelta(days=1))
+        except ValueError:
+            report_invalid_filter('Formato de data inválido. Use AAAA-MM-DD.')
 
-    if request.method == 'POST':
-        # Get filter values
-        infopen = request.form.get('infopen')
-        nome_completo = request.form.get('nome_completo')
-        cpf = request.form.get('cpf')
-        municipio = request.form.get('municipio')
-        ueop = request.form.get('ueop')
-        cia = request.form.get('cia')
-        data_modificacao = request.form.get('data_modificacao')
-        ano_modificacao = request.form.get('ano_modificacao')
-        mes_modificacao = request.form.get('mes_modificacao')
-
-        # Build query with filters
-        query = UserRegistration.query
-
-        if infopen:
-            query = query.filter(
-                UserRegistration.infopen.ilike(f'%{infopen}%'))
-        if nome_completo:
-            query = query.filter(
-                UserRegistration.nome_completo.ilike(f'%{nome_completo}%'))
-        if cpf:
-            query = query.filter(UserRegistration.cpf.ilike(f'%{cpf}%'))
-        if municipio:
-            query = query.filter(
-                UserRegistration.municipio.ilike(f'%{municipio}%'))
-        if ueop:
-            query = query.filter(UserRegistration.ueop.ilike(f'%{ueop}%'))
-        if cia:
-            query = query.filter(UserRegistration.cia.ilike(f'%{cia}%'))
-
-        # Date filters based on data_modificacao
-        if data_modificacao:
-            # Parse the date string and filter for that specific date
-            from datetime import datetime
-            try:
-                parsed_date = datetime.strptime(data_modificacao, '%Y-%m-%d').date()
-                query = query.filter(db.func.date(UserRegistration.data_modificacao) == parsed_date)
-            except ValueError:
-                flash('Formato de data inválido. Use AAAA-MM-DD.', 'error')
+    ano = None
+    if 'ano_modificacao' in filters:
+        try:
+            ano = int(filters['ano_modificacao'])
+            query = query.filter(data_modificacao >= datetime(ano, 1, 1),
+                                 data_modificacao < datetime(ano + 1, 1, 1))
+        except ValueError:
+            ano = None
+            report_invalid_filter('Ano inválido. Use formato numérico (ex: 2026).')
 
-        if ano_modificacao:
-            try:
-                ano = int(ano_modificacao)
-                query = query.filter(db.extract('year', UserRegistration.data_modificacao) == ano)
-            except ValueError:
-                flash('Ano inválido. Use formato numérico (ex: 2026).', 'error')
+    if 'mes_modificacao' in filters:
+        try:
+            mes = int(filters['mes_modificacao'])
+            if ano is not None:
+                years = [ano]
+            else:
+                # One range per year that has data, from the oldest modification up to now
+                oldest = db.session.query(db.func.min(data_modificacao)).scalar()
+                first_year = oldest.year if oldest else get_current_time_brasilia().year
+                years = range(first_year, get_current_time_brasilia().year + 1)
+            query = query.filter(db.or_(*[
+                db.and_(data_modificacao >= month_start, data_modificacao < month_end)
+                for month_start, month_end in (month_range(year, mes) for year in years)
+            ]))
+        except ValueError:
+            report_invalid_filter('Mês inválido. Use formato numérico (1-12).')
 
-        if mes_modificacao:
-            try:
-                mes = int(mes_modificacao)
-                query = query.filter(db.extract('month', UserRegistration.data_modificacao) == mes)
-            except ValueError:
-                flash('Mês inválido. Use formato numérico (1-12).', 'error')
+    return query
+
+
+def count_search_results(query, filters):
+    """Count the matches of a filter set, reusing the last count until user_registration changes"""
+    cache_key = tuple(sorted(filters.items()))
+    version = get_data_version('user_registration')
+
+    cached = SEARCH_COUNT_CACHE.get(cache_key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    total = query.with_entities(db.func.count(UserRegistration.id)).scalar()
+    SEARCH_COUNT_CACHE.set(cache_key, (version, total))
+    return total
+
+
+class RedisCacheBackend:
+    """Cache shared by every worker, kept in Redis with a TTL; an unreachable Redis only causes misses"""
+
+    def __init__(self, client, ttl, prefix='iaap:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            return self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            app.logger.warning('Cache de busca indisponível: %s', e)
+            return None
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.prefix + key, value, ex=self.ttl)
+        except redis.RedisError as e:
+            app.logger.warning('Cache de busca indisponível: %s', e)
+
+
+def get_search_cache():
+    """Backend of the /search result cache, or None when SEARCH_CACHE_BACKEND=none.
+
+    Tests can swap it with `app.extensions['search_cache'] = LocalCacheBackend(...)`.
+    """
+    if 'search_cache' not in app.extensions:
+        backend = app.config['SEARCH_CACHE_BACKEND']
+        if backend == 'none':
+            app.extensions['search_cache'] = None
+        elif backend == 'redis':
+            if redis is None:
+                raise RuntimeError('SEARCH_CACHE_BACKEND=redis requer o pacote redis (pip install redis).')
+            client = redis.Redis.from_url(app.config['SEARCH_CACHE_URL'], socket_timeout=0.5)
+            app.extensions['search_cache'] = RedisCacheBackend(client, app.config['SEARCH_CACHE_TTL'])
+        else:
+            app.extensions['search_cache'] = LocalCacheBackend(
+                app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL'])
+    return app.extensions['search_cache']
+
+
+# Columns of a /search row, as cached and as read by search.html
+SEARCH_PAGE_FIELDS = (
+    'id', 'infopen', 'nome_completo', 'cpf', 'rua', 'numero', 'bairro', 'municipio',
+    'ueop', 'cia', 'latitude', 'longitude', 'data_modificacao'
+)
+SearchRow = namedtuple('SearchRow', SEARCH_PAGE_FIELDS)
+
+
+def search_page_key(filters, after, before, per_page, version):
+    """Cache key of a /search page; a write bumps version, so pages are never served stale"""
+    # UEOP, CIA and município are compared uppercased (see apply_search_filters)
+    normalized = sorted((field, value.upper() if field in ('municipio', 'ueop', 'cia') else value)
+                        for field, value in filters.items())
+    payload = json.dumps([version, get_latest_schema_version(), normalized, after, before, per_page])
+    return 'search:' + hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def load_search_page(filters, per_page, after, before):
+    """Query one /search page as plain values that can be cached"""
+    query = apply_search_filters(UserRegistration.query, filters)
+
+    # Seek to the requested page, resolving the image flag in the same query
+    rows, prev_cursor, next_cursor = paginate_by_keyset(
+        query.add_columns(image_exists_column()), (UserRegistration.nome_completo, UserRegistration.id),
+        per_page, after=after, before=before)
+    return {
+        'rows': [
+            dict({field: getattr(user, field) for field in SEARCH_PAGE_FIELDS}, has_image=bool(has_image),
+                 data_modificacao=user.data_modificacao.isoformat() if user.data_modificacao else None)
+            for user, has_image in rows
+        ],
+        'prev_cursor': prev_cursor,
+        'next_cursor': next_cursor,
+        'total': count_search_results(query, filters),
+    }
+
+
+def encode_cursor(values):
+    """Opaque page cursor holding the sort key values of a row"""
+    payload = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    """Sort key values of a cursor, converted back to the types of columns, or None if malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if len(values) != len(columns):
+            return None
+        return tuple(
+            datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+            for column, value in zip(columns, values))
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+class KeysetPage:
+    """A page of search results plus the cursors of the neighbouring pages"""
+
+    def __init__(self, items, prev_cursor, next_cursor, total):
+        self.items = items
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.total = total
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def paginate_by_keyset(query, sort_columns, per_page, after=None, before=None, descending=False):
+    """Seek to the page after/before a cursor on sort_columns instead of using OFFSET
+
+    query must select the entity owning sort_columns as its first entity, and
+    sort_columns must end with a unique column (e.g. the primary key).
+    """
+    sort_key = db.tuple_(*sort_columns)
+    before_key = decode_cursor(before, sort_columns) if before else None
+    after_key = decode_cursor(after, sort_columns) if after else None
+    forward_order = [column.desc() if descending else column.asc() for column in sort_columns]
+    backward_order = [column.asc() if descending else column.desc() for column in sort_columns]
+
+    if before_key:
+        # Walk backwards from the cursor, then restore the display order
+        rows = query.filter(sort_key > before_key if descending else sort_key < before_key).order_by(
+            *backward_order).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after_key:
+            query = query.filter(sort_key < after_key if descending else sort_key > after_key)
+        rows = query.order_by(*forward_order).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after_key is not None
+
+    def row_cursor(row):
+        return encode_cursor([getattr(row[0], column.key) for column in sort_columns])
+
+    prev_cursor = row_cursor(rows[0]) if rows and has_prev else None
+    next_cursor = row_cursor(rows[-1]) if rows and has_next else None
+    return rows, prev_cursor, next_cursor
 
-        # Paginate the results
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        users = pagination.items
 
-        # For each user, check if they have an associated image
-        users_with_images = []
-        for user in users:
-            image_exists = Images.query.filter_by(infopen=user.infopen).first() if user.infopen else None
-            users_with_images.append((user, bool(image_exists)))
+@app.route('/search', methods=['GET', 'POST'])
+def search():
+    per_page = 50  # Number of records per page
 
-        # Prepare enterprise data for the template
-        return render_template('search.html', active_page='search', show_institutional_content=False, users=users_with_images, pagination=pagination,
-                               enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+    # Filters come from the form on POST and from the pagination links on GET
+    filters = get_search_filters(request.values)
+    after, before = request.args.get('after'), request.args.get('before')
+
+    cache = get_search_cache()
+    cache_key = search_page_key(filters, after, before, per_page, get_data_version('user_registration'))
+    cached = cache.get(cache_key) if cache else None
+    METRICS.inc('search_cache_requests_total', result='hit' if cached else 'miss')
+    if cached:
+        page = json.loads(cached)
     else:
-        # For GET requests (no filters), get all users and check for associated images
-        pagination = UserRegistration.query.paginate(page=page, per_page=per_page, error_out=False)
-        users = pagination.items
+        page = load_search_page(filters, per_page, after, before)
+        if cache and not g.get('invalid_search_filter'):
+            cache.set(cache_key, json.dumps(page))
 
-        users_with_images = []
-        for user in users:
-            image_exists = Images.query.filter_by(infopen=user.infopen).first() if user.infopen else None
-            users_with_images.append((user, bool(image_exists)))
+    rows = []
+    for row in page['rows']:
+        values = {field: row.get(field) for field in SEARCH_PAGE_FIELDS}
+        if values['data_modificacao']:
+            values['data_modificacao'] = datetime.fromisoformat(values['data_modificacao'])
+        rows.append((SearchRow(**values), row['has_image']))
+    pagination = KeysetPage(rows, page['prev_cursor'], page['next_cursor'], page['total'])
 
-        # Prepare enterprise data for the template
-        return render_template('search.html', active_page='search', show_institutional_content=False, users=users_with_images, pagination=pagination,
-                               enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+    # Prepare enterprise data for the template
+    return render_template('search.html', active_page='search', show_institutional_content=False, users=pagination.items, pagination=pagination,
+                           filters=filters)
 
 
 @app.route('/edit/<int:user_id>', methods=['GET', 'POST'])
 def edit(user_id):
     user = UserRegistration.query.get_or_404(user_id)
     # Check if user has an associated image
-    image_exists = Images.query.filter_by(infopen=user.infopen).first() if user.infopen else None
+    image_exists = db.session.query(Images.id).filter_by(infopen=user.infopen).first() if user.infopen else None
 
     if request.method == 'POST':
         # Update user data
@@ -416,7 +2570,7 @@ def edit(user_id):
         # Backend validation for infopen field
         if not infopen or not infopen.strip():
             flash('O campo Infopen é obrigatório.', 'error')
-            return render_template('edit.html', active_page='register', show_institutional_content=False, user=user, image_exists=image_exists, enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+            return render_template('edit.html', active_page='register', show_institutional_content=False, user=user, image_exists=image_exists)
 
         # Check if infopen already exists for a different user (avoiding self-conflict)
         existing_user = UserRegistration.query.filter(
@@ -425,7 +2579,7 @@ def edit(user_id):
         ).first()
         if existing_user:
             flash('Egresso já cadastrado!', 'error')
-            return render_template('edit.html', active_page='register', show_institutional_content=False, user=user, image_exists=image_exists, enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+            return render_template('edit.html', active_page='register', show_institutional_content=False, user=user, image_exists=image_exists)
 
         user.infopen = infopen
         user.nome_completo = request.form.get('nome_completo')
@@ -442,34 +2596,16 @@ def edit(user_id):
         user.latitude = request.form.get('latitude')
         user.longitude = request.form.get('longitude')
 
-        # Handle image upload - convert to Base64 and store in images table
-        if 'imagem_perfil' in request.files:
-            file = request.files['imagem_perfil']
-            if file and file.filename != '' and allowed_file(file.filename):
-                # Read the file content
-                file_content = file.read()
-
-                # Calculate the SHA256 hash of the image file
-                image_hash = hashlib.sha256(file_content).hexdigest()
-
-                # Convert the image to Base64
-                image_b64 = base64.b64encode(file_content).decode('utf-8')
-
-                # Store the Base64 image in the images table
-                # First, check if an image already exists for this infopen and delete it
-                existing_image = Images.query.filter_by(
-                    infopen=user.infopen).first()
-                if existing_image:
-                    db.session.delete(existing_image)
-
-                # Create new image record
-                new_image = Images(
-                    infopen=user.infopen,
-                    image_b64=image_b64,
-                    imagem_perfil=user.infopen,  # For consistency
-                    image_hash=image_hash
-                )
-                db.session.add(new_image)
+        # Handle image upload - store the raw bytes in the content-addressed blob store
+        file = request.files.get('imagem_perfil')
+        if file and file.filename != '':
+            try:
+                store_profile_image(user.infopen, read_image_upload(file))
+            except UploadRejected as e:
+                db.session.rollback()
+                flash(str(e), 'error')
+                return render_template('edit.html', active_page='register', show_institutional_content=False,
+                                       user=user, image_exists=image_exists)
 
         try:
             db.session.commit()
@@ -479,35 +2615,450 @@ def edit(user_id):
             db.session.rollback()
             flash(f'Erro ao atualizar o registro: {str(e)}', 'error')
 
-    return render_template('edit.html', active_page='register', show_institutional_content=False, user=user, image_exists=image_exists, enterprise_data=ENTERPRISE_DATA, municipalities=MUNICIPALITIES)
+    return render_template('edit.html', active_page='register', show_institutional_content=False, user=user, image_exists=image_exists)
 
-# Add route to serve Base64 images from the database
+# Add route to serve images from the blob store
 
 
 @app.route('/image/<infopen>')
 def get_image(infopen):
+    from flask import Response, abort
+
+    blob = db.session.query(ImageBlob.image_hash, ImageBlob.data, ImageBlob.mimetype).join(
+        Images, Images.image_hash == ImageBlob.image_hash
+    ).filter(Images.infopen == infopen).first()
+
+    if blob:
+        # Raw bytes are sent as stored; the content hash doubles as a strong ETag
+        response = Response(blob.data, mimetype=blob.mimetype)
+        response.set_etag(blob.image_hash)
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response.make_conditional(request)
+
+    # Fall back to rows not yet converted by `flask migrate-images`
     image_record = Images.query.filter_by(infopen=infopen).first()
-    if image_record:
-        # Decode the Base64 image and return it
+    if image_record and image_record.image_b64:
         image_data = base64.b64decode(image_record.image_b64)
-        from flask import Response
-        import io
-        # Determine content type based on image data
-        if image_data.startswith(b'\x89PNG\r\n\x1a\n'):
-            content_type = 'image/png'
-        elif image_data.startswith(b'\xff\xd8\xff'):
-            content_type = 'image/jpeg'
-        elif image_data.startswith(b'GIF87a') or image_data.startswith(b'GIF89a'):
-            content_type = 'image/gif'
-        else:
-            content_type = 'image/jpeg'  # default
+        return Response(image_data, mimetype=detect_image_mimetype(image_data))
 
-        return Response(image_data, mimetype=content_type)
-    else:
-        # Return a default image or 404
-        from flask import abort
+    # Return a default image or 404
+    abort(404)
+
+
+@app.route('/image/<infopen>/<size>')
+def get_image_variant(infopen, size):
+    from flask import Response, abort
+
+    if size not in IMAGE_VARIANTS:
         abort(404)
 
+    variant = db.session.query(ImageVariant.image_hash, ImageVariant.data, ImageVariant.mimetype).join(
+        Images, Images.image_hash == ImageVariant.image_hash
+    ).filter(Images.infopen == infopen, ImageVariant.size_name == size).first()
+
+    if not variant:
+        # Generate lazily for images stored before thumbnails existed
+        blob = ImageBlob.query.join(
+            Images, Images.image_hash == ImageBlob.image_hash
+        ).filter(Images.infopen == infopen).first()
+        if not blob:
+            # Legacy Base64 rows are served in full until migrated
+            return get_image(infopen)
+
+        variant = get_or_create_image_variant(blob, size)
+        if variant is None:
+            return get_image(infopen)
+        try:
+            db.session.commit()
+        except Exception:
+            # Another request stored the same variant first
+            db.session.rollback()
+
+    response = Response(variant.data, mimetype=variant.mimetype)
+    response.set_etag(f'{variant.image_hash}-{size}')
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response.make_conditional(request)
+
+
+# Lightweight handle on the SQLite R*Tree created by create_geo_index
+user_registration_geo = db.table(
+    'user_registration_geo', db.column('id'), db.column('min_lat'), db.column('max_lat'),
+    db.column('min_lng'), db.column('max_lng'))
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points, in kilometers"""
+    lat1, lng1, lat2, lng2 = (math.radians(value) for value in (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def geohash_prefixes(south, west, north, east, max_cells=32):
+    """Smallest set of equal-length geohash prefixes whose cells cover the bounding box"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        rows = math.floor(north / height) - math.floor(south / height) + 1
+        columns = math.floor(east / width) - math.floor(west / width) + 1
+        if rows * columns <= max_cells or precision == 1:
+            break
+
+    prefixes = set()
+    for row in range(rows):
+        latitude = min(south + row * height, north)
+        for column in range(columns):
+            longitude = min(west + column * width, east)
+            prefixes.add(geohash_encode(latitude, longitude, precision))
+        prefixes.add(geohash_encode(latitude, east, precision))
+    for column in range(columns):
+        prefixes.add(geohash_encode(north, min(west + column * width, east), precision))
+    prefixes.add(geohash_encode(north, east, precision))
+    return sorted(prefixes)
+
+
+def find_in_bbox(south, west, north, east, ueop=None, cia=None):
+    """Query of the registrations inside a bounding box, through the spatial index"""
+    if db.engine.dialect.name == 'sqlite':
+        # The R*Tree stores 32-bit boxes rounded outward, so match by overlap and let the
+        # exact comparisons below settle points on the edges
+        candidates = UserRegistration.id.in_(
+            db.select(user_registration_geo.c.id).where(
+                user_registration_geo.c.max_lat >= south, user_registration_geo.c.min_lat <= north,
+                user_registration_geo.c.max_lng >= west, user_registration_geo.c.min_lng <= east))
+    else:
+        # A prefix as a half-open range: unlike LIKE 'prefix%', any btree index serves it, not
+        # only one built under the C collation ('~' sorts after every geohash character)
+        candidates = db.or_(*[db.and_(UserRegistration.geohash >= prefix, UserRegistration.geohash < prefix + '~')
+                              for prefix in geohash_prefixes(south, west, north, east)])
+
+    query = UserRegistration.query.filter(
+        candidates,
+        UserRegistration.latitude_num.between(south, north),
+        UserRegistration.longitude_num.between(west, east))
+    if ueop:
+        query = query.filter(UserRegistration.ueop == ueop.upper())
+    if cia:
+        query = query.filter(UserRegistration.cia == cia.upper())
+    return query
+
+
+# Columns read by geo_result, so geographic lookups never load whole rows
+GEO_RESULT_COLUMNS = (
+    UserRegistration.id, UserRegistration.infopen, UserRegistration.nome_completo, UserRegistration.rua,
+    UserRegistration.numero, UserRegistration.bairro, UserRegistration.municipio, UserRegistration.ueop,
+    UserRegistration.cia, UserRegistration.latitude_num, UserRegistration.longitude_num,
+)
+
+
+def find_nearby(latitude, longitude, radius_km, ueop=None, cia=None, limit=200):
+    """Registrations within radius_km of a point as (row, distance_km), nearest first"""
+    # Pre-filter with the bounding box of the circle, then measure the real distance
+    lng_scale = max(math.cos(math.radians(latitude)), 0.01)
+    lat_delta = radius_km / 111.32
+    lng_delta = radius_km / (111.32 * lng_scale)
+    query = find_in_bbox(max(latitude - lat_delta, -90), max(longitude - lng_delta, -180),
+                         min(latitude + lat_delta, 90), min(longitude + lng_delta, 180), ueop, cia)
+
+    # Only the nearest candidates by the flat-earth distance (within 1% of the real one
+    # at these radii) leave the database; twice the limit leaves room for that error
+    lat_offset = UserRegistration.latitude_num - latitude
+    lng_offset = (UserRegistration.longitude_num - longitude) * lng_scale
+    candidates = query.with_entities(*GEO_RESULT_COLUMNS).order_by(
+        lat_offset * lat_offset + lng_offset * lng_offset).limit(limit * 2)
+
+    nearby = []
+    for user in candidates:
+        distance = haversine_km(latitude, longitude, user.latitude_num, user.longitude_num)
+        if distance <= radius_km:
+            nearby.append((user, distance))
+    nearby.sort(key=lambda item: item[1])
+    return nearby[:limit]
+
+
+def geo_result(user, distance_km=None):
+    result = {
+        'id': user.id,
+        'infopen': user.infopen,
+        'nome_completo': user.nome_completo,
+        'endereco': f"{user.rua or ''} {user.numero or ''}, {user.bairro or ''}".strip(' ,'),
+        'municipio': user.municipio,
+        'ueop': user.ueop,
+        'cia': user.cia,
+        'latitude': user.latitude_num,
+        'longitude': user.longitude_num,
+    }
+    if distance_km is not None:
+        result['distancia_km'] = round(distance_km, 3)
+    return result
+
+
+@app.route('/api/geo/nearby')
+def geo_nearby():
+    """Egressos within radius_km (default 1) of lat/lng, optionally filtered by UEOP/CIA"""
+    latitude = parse_coordinate(request.args.get('lat'), 90)
+    longitude = parse_coordinate(request.args.get('lng'), 180)
+    radius_km = request.args.get('radius_km', 1.0, type=float)
+    limit = request.args.get('limit', 200, type=int)
+    if latitude is None or longitude is None or not 0 < radius_km <= 100:
+        return {'error': 'Informe lat, lng e radius_km (até 100 km) válidos.'}, 400
+    if not 1 <= limit <= 1000:
+        return {'error': 'Informe limit entre 1 e 1000.'}, 400
+
+    nearby = find_nearby(latitude, longitude, radius_km,
+                         request.args.get('ueop'), request.args.get('cia'), limit)
+    return {'results': [geo_result(user, distance) for user, distance in nearby]}
+
+
+@app.route('/api/geo/bbox')
+def geo_bbox():
+    """Egressos inside the south/west/north/east bounding box, optionally filtered by UEOP/CIA"""
+    south = parse_coordinate(request.args.get('south'), 90)
+    north = parse_coordinate(request.args.get('north'), 90)
+    west = parse_coordinate(request.args.get('west'), 180)
+    east = parse_coordinate(request.args.get('east'), 180)
+    limit = request.args.get('limit', 500, type=int)
+    if None in (south, west, north, east) or south > north or west > east:
+        return {'error': 'Informe south, west, north e east válidos.'}, 400
+    if not 1 <= limit <= 5000:
+        return {'error': 'Informe limit entre 1 e 5000.'}, 400
+
+    users = find_in_bbox(south, west, north, east, request.args.get('ueop'), request.args.get('cia')).with_entities(
+        *GEO_RESULT_COLUMNS).limit(limit).all()
+    return {'results': [geo_result(user) for user in users]}
+
+
+# Map tiles are 256px squares split into MAP_CLUSTER_GRID x MAP_CLUSTER_GRID cells, one
+# cluster per occupied cell, so each tile response is bounded whatever the zoom level
+MAP_TILE_SIZE = 256
+MAP_CLUSTER_GRID = 4
+MAP_MAX_ZOOM = 18
+MAP_TILE_CACHE_SIZE = 2048
+MAP_TILE_CACHE = LocalCacheBackend(MAP_TILE_CACHE_SIZE)
+
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of a Web Mercator (slippy map) tile"""
+    def tile_latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / 2 ** z))))
+
+    return (tile_latitude(y + 1), x / 2 ** z * 360 - 180,
+            tile_latitude(y), (x + 1) / 2 ** z * 360 - 180)
+
+
+def world_pixel(latitude, longitude, z):
+    """Web Mercator pixel coordinates of a point at zoom z"""
+    scale = MAP_TILE_SIZE * 2 ** z
+    sin_latitude = min(max(math.sin(math.radians(latitude)), -0.9999), 0.9999)
+    return ((longitude + 180) / 360 * scale,
+            (0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)) * scale)
+
+
+def build_map_tile(z, x, y):
+    """Clusters of the registrations inside a map tile"""
+    rows = find_in_bbox(*tile_bounds(z, x, y)).with_entities(
+        UserRegistration.id, UserRegistration.latitude_num, UserRegistration.longitude_num)
+
+    cell_size = MAP_TILE_SIZE / MAP_CLUSTER_GRID
+    cells = {}
+    for user_id, latitude, longitude in rows:
+        pixel_x, pixel_y = world_pixel(latitude, longitude, z)
+        # Points on a shared edge belong to a single tile
+        if int(pixel_x // MAP_TILE_SIZE) != x or int(pixel_y // MAP_TILE_SIZE) != y:
+            continue
+        cell = (int(pixel_x % MAP_TILE_SIZE // cell_size), int(pixel_y % MAP_TILE_SIZE // cell_size))
+        cluster = cells.setdefault(cell, {'count': 0, 'lat': 0.0, 'lng': 0.0, 'id': user_id})
+        cluster['count'] += 1
+        cluster['lat'] += latitude
+        cluster['lng'] += longitude
+
+    clusters = []
+    for cluster in cells.values():
+        count = cluster['count']
+        clusters.append({'count': count, 'lat': cluster['lat'] / count, 'lng': cluster['lng'] / count,
+                         'id': cluster['id'] if count == 1 else None})
+
+    # Name the single points in one query so the map can label them
+    single_ids = [cluster['id'] for cluster in clusters if cluster['id']]
+    if single_ids:
+        names = dict(db.session.query(UserRegistration.id, UserRegistration.nome_completo)
+                     .filter(UserRegistration.id.in_(single_ids)))
+        for cluster in clusters:
+            if cluster['id']:
+                cluster['nome_completo'] = names.get(cluster['id'])
+    return clusters
+
+
+def get_map_tile(z, x, y):
+    """Clusters of a map tile, reusing the last build until user_registration changes"""
+    cache_key = (z, x, y)
+    version = get_data_version('user_registration')
+
+    cached = MAP_TILE_CACHE.get(cache_key)
+    if cached and cached[0] == version:
+        return version, cached[1]
+
+    clusters = build_map_tile(z, x, y)
+    MAP_TILE_CACHE.set(cache_key, (version, clusters))
+    return version, clusters
+
+
+@app.route('/api/geo/tiles/<int:z>/<int:x>/<int:y>')
+def geo_tile(z, x, y):
+    """Pre-clustered egressos of a z/x/y map tile"""
+    if not 0 <= z <= MAP_MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return {'error': 'Tile inválido.'}, 404
+
+    version, clusters = get_map_tile(z, x, y)
+    response = app.make_response({'clusters': clusters})
+    # Revalidate on every view, the data version makes the ETag change on writes
+    response.set_etag(f'{version}-{z}-{x}-{y}')
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/registry_map')
+def registry_map():
+    """Operational map with every registered egresso"""
+    return render_template('registry_map.html', active_page='registry_map', show_institutional_content=False,
+                           max_zoom=MAP_MAX_ZOOM)
+
+
+# Words that don't change where an address is, dropped from the cache key
+ADDRESS_NOISE_WORDS = {'MG', 'MINAS', 'GERAIS', 'BRASIL', 'BRAZIL'}
+
+
+def normalize_address(value):
+    """Cache key of an address: accent-folded, uppercase, no punctuation or state/country suffix"""
+    folded = fold_search_text(value) or ''
+    words = re.sub(r'[^A-Z0-9 ]', ' ', folded).split()
+    while words and words[-1] in ADDRESS_NOISE_WORDS:
+        words.pop()
+    return ' '.join(words)[:300]
+
+
+class GeocoderUnavailable(Exception):
+    """The upstream geocoder could not be reached or gave an unusable answer"""
+
+
+class NominatimGeocoder:
+    """Upstream geocoder speaking the Nominatim search API"""
+
+    def __init__(self, url, user_agent, timeout):
+        self.url = url
+        self.user_agent = user_agent
+        self.timeout = timeout
+
+    def search(self, address):
+        """(latitude, longitude, display_name) of the best match, or None"""
+        params = urllib.parse.urlencode({'q': address, 'format': 'json', 'limit': 1, 'countrycodes': 'br'})
+        upstream_request = urllib.request.Request(f'{self.url}?{params}', headers={'User-Agent': self.user_agent})
+        try:
+            with urllib.request.urlopen(upstream_request, timeout=self.timeout) as response:
+                matches = json.load(response)
+        except (OSError, ValueError) as e:
+            raise GeocoderUnavailable(str(e)) from e
+        if not matches:
+            return None
+        try:
+            latitude, longitude = float(matches[0]['lat']), float(matches[0]['lon'])
+            display_name = matches[0].get('display_name')
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            raise GeocoderUnavailable(f'Resposta inesperada: {e!r}') from e
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise GeocoderUnavailable(f'Coordenadas inválidas: {latitude}, {longitude}')
+        return latitude, longitude, display_name
+
+
+class StaticGeocoder:
+    """Local stand-in for the upstream geocoder, answering from a fixed {address: (lat, lng)} map"""
+
+    def __init__(self, places=None):
+        self.places = {normalize_address(address): coordinates for address, coordinates in (places or {}).items()}
+        self.calls = 0
+
+    def search(self, address):
+        self.calls += 1
+        coordinates = self.places.get(normalize_address(address))
+        if coordinates is None:
+            return None
+        return coordinates[0], coordinates[1], address
+
+
+def get_upstream_geocoder():
+    """Geocoder consulted on cache misses, or None when GEOCODER_UPSTREAM=none.
+
+    Tests can swap it with `app.extensions['geocoder'] = StaticGeocoder({...})`.
+    """
+    if 'geocoder' not in app.extensions:
+        if app.config['GEOCODER_UPSTREAM'] == 'none':
+            app.extensions['geocoder'] = None
+        else:
+            app.extensions['geocoder'] = NominatimGeocoder(
+                app.config['GEOCODER_URL'], app.config['GEOCODER_USER_AGENT'], app.config['GEOCODER_TIMEOUT'])
+    return app.extensions['geocoder']
+
+
+def store_geocode(address, coordinates, source):
+    """Remember the result of a lookup; coordinates is (lat, lng, display_name) or None for a miss"""
+    latitude, longitude, display_name = coordinates or (None, None, None)
+    query_key = normalize_address(address)
+    entry = db.session.merge(GeocodeCache(
+        query_key=query_key, address=address[:300], latitude=latitude, longitude=longitude,
+        display_name=(display_name or '')[:300] or None, source=source, created_at=get_current_time_brasilia()))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent miss on the same address stored it first; keep theirs
+        db.session.rollback()
+        entry = db.session.get(GeocodeCache, query_key)
+    return entry
+
+
+def geocode(address):
+    """Coordinates of an address as a GeocodeCache entry, or None when nobody knows the place.
+
+    Raises GeocoderUnavailable when the address isn't cached and the upstream can't be reached.
+    """
+    query_key = normalize_address(address)
+    if not query_key:
+        return None
+
+    entry = db.session.get(GeocodeCache, query_key)
+    if entry and entry.latitude is not None:
+        return entry
+    if entry:
+        # Remembered miss: don't ask the upstream again until it expires
+        age = get_current_time_brasilia().replace(tzinfo=None) - entry.created_at.replace(tzinfo=None)
+        if age < timedelta(seconds=app.config['GEOCODE_NEGATIVE_TTL']):
+            return None
+
+    upstream = get_upstream_geocoder()
+    if upstream is None:
+        return None
+    entry = store_geocode(address, upstream.search(address), 'upstream')
+    return entry if entry.latitude is not None else None
+
+
+@app.route('/api/geocode')
+def geocode_address():
+    """Coordinates of the address in q, answered from the local cache whenever possible"""
+    address = request.args.get('q', '').strip()
+    if not normalize_address(address):
+        return {'error': 'Informe um endereço.'}, 400
+
+    try:
+        entry = geocode(address)
+    except GeocoderUnavailable as e:
+        app.logger.warning('Geocodificador indisponível: %s', e)
+        return {'error': 'Serviço de geocodificação indisponível. Tente novamente mais tarde.'}, 503
+    if entry is None:
+        return {'error': 'Endereço não encontrado.'}, 404
+
+    return {'latitude': entry.latitude, 'longitude': entry.longitude,
+            'display_name': entry.display_name or entry.address, 'source': entry.source}
+
 
 # Route for the interactive map modal
 @app.route('/map')
@@ -524,6 +3075,7 @@ def delete(user_id):
         existing_image = Images.query.filter_by(infopen=user.infopen).first()
         if existing_image:
             db.session.delete(existing_image)
+            release_image_blob(existing_image.image_hash)
 
         # Delete the user from the database
         db.session.delete(user)
@@ -536,6 +3088,84 @@ def delete(user_id):
     return redirect(url_for('search'))
 
 
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_PAGE_SIZE = 5000
+
+
+@app.route('/api/changes')
+def change_feed():
+    """Registration and SEEU inserts, updates and deletes after the since cursor, oldest first
+
+    Consumers start without a cursor (every existing row is logged as an insert)
+    and keep passing back next_cursor; deletes come as tombstones.
+    """
+    sort_columns = (ChangeLog.txid, ChangeLog.id)
+    since = request.args.get('since')
+    since_key = decode_cursor(since, sort_columns) if since else None
+    limit = request.args.get('limit', CHANGE_FEED_PAGE_SIZE, type=int)
+    entity = request.args.get('entity')
+    if (since and since_key is None) or not 0 < limit <= CHANGE_FEED_MAX_PAGE_SIZE or \
+            entity not in (None, *CHANGE_FEED_FIELDS):
+        return {'error': f'Informe um since recebido em next_cursor, limit entre 1 e {CHANGE_FEED_MAX_PAGE_SIZE} '
+                         f'e entity entre {", ".join(CHANGE_FEED_FIELDS)}.'}, 400
+
+    query = ChangeLog.query
+    if since_key:
+        query = query.filter(db.tuple_(*sort_columns) > since_key)
+    if entity:
+        query = query.filter(ChangeLog.entity == entity)
+    if db.engine.dialect.name == 'postgresql':
+        # Stop before the oldest transaction still in progress, whose entries may appear later
+        query = query.filter(ChangeLog.txid < db.func.txid_snapshot_xmin(db.func.txid_current_snapshot()))
+    entries = query.order_by(*sort_columns).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    return {
+        'changes': [{
+            'cursor': encode_cursor([entry.txid, entry.id]),
+            'entity': entry.entity,
+            'id': entry.entity_id,
+            'operation': entry.operation,
+            'changed_at': entry.changed_at.isoformat(),
+            'data': json.loads(entry.data) if entry.data else None,
+        } for entry in entries],
+        'next_cursor': encode_cursor([entries[-1].txid, entries[-1].id]) if entries else since,
+        'has_more': has_more,
+    }
+
+
+def get_egresso_nome(infopen):
+    """Name of the egresso registered under infopen, or None"""
+    if not infopen:
+        return None
+    return db.session.query(UserRegistration.nome_completo).filter_by(infopen=infopen).scalar()
+
+
+@app.route('/api/egressos')
+def egressos_typeahead():
+    """Top matches of an infopen or name fragment, for the SEEU autocomplete fields"""
+    term = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    if not term:
+        return {'results': []}
+
+    escaped = escape_like(fold_search_text(term) or '')
+    # Prefix matches first, then the remaining substring matches alphabetically
+    prefix_rank = db.case(
+        (UserRegistration.infopen.like(f'{escaped}%', escape='\\'), 0),
+        (UserRegistration.nome_busca.like(f'{escaped}%', escape='\\'), 0),
+        else_=1)
+
+    matches = db.session.query(UserRegistration.infopen, UserRegistration.nome_completo).filter(
+        UserRegistration.infopen.isnot(None),
+        db.or_(search_filter('infopen', term), search_filter('nome_completo', term))
+    ).order_by(prefix_rank, UserRegistration.nome_completo).limit(limit).all()
+
+    return {'results': [{'infopen': infopen, 'nome_completo': nome_completo}
+                        for infopen, nome_completo in matches]}
+
+
 @app.route('/seeu', methods=['GET', 'POST'])
 def seeu():
     # Get infopen from URL parameters for pre-selecting in the dropdown
@@ -545,7 +3175,7 @@ def seeu():
     # We check for a field unique to the creation form, like 'protocolo',
     # to distinguish it from a filter POST.
     if request.method == 'POST' and 'protocolo' in request.form:
-        infopen = request.form.get('infopen')
+        infopen = request.form.get('infopen', '').strip().upper()
         data_notificacao = request.form.get('data_notificacao')
         numero_seeu = request.form.get('numero_seeu')
         protocolo = request.form.get('protocolo')
@@ -553,6 +3183,8 @@ def seeu():
 
         if not infopen:
             flash('O campo Infopen é obrigatório para criar um registro.', 'error')
+        elif not get_egresso_nome(infopen):
+            flash('Nenhum egresso cadastrado com este Infopen.', 'error')
         else:
             data_notificacao_obj = None
             if data_notificacao:
@@ -589,15 +3221,12 @@ def seeu():
     filter_nome = request.values.get('filter_nome', '').strip()
     filter_numero_seeu = request.values.get('filter_numero_seeu', '').strip()
 
-    # Start with a base query on the Judiciary table
-    query = Judiciary.query
+    # Fetch each record together with its egresso name in a single query
+    query = db.session.query(Judiciary, UserRegistration.nome_completo).outerjoin(
+        UserRegistration, Judiciary.infopen == UserRegistration.infopen)
 
-    # Conditionally join with UserRegistration only if filtering by name
     if filter_nome:
-        query = query.join(
-            UserRegistration, Judiciary.infopen == UserRegistration.infopen)
-        query = query.filter(
-            UserRegistration.nome_completo.ilike(f'%{filter_nome}%'))
+        query = query.filter(search_filter('nome_completo', filter_nome))
 
     # Apply infopen filter if provided
     if filter_infopen:
@@ -607,21 +3236,23 @@ def seeu():
     if filter_numero_seeu:
         query = query.filter(Judiciary.numero_seeu.ilike(f'%{filter_numero_seeu}%'))
 
-    # Execute the final query
-    judiciary_records = query.order_by(Judiciary.data_registro.desc()).all()
+    # Newest records first, one page at a time
+    judiciary_records, prev_cursor, next_cursor = paginate_by_keyset(
+        query, (Judiciary.data_registro, Judiciary.id), per_page=50, descending=True,
+        after=request.args.get('after'), before=request.args.get('before'))
 
-    # Get all users for the registration dropdown
-    users = UserRegistration.query.order_by(
-        UserRegistration.nome_completo).all()
+    # The egresso field is filled through /api/egressos; only the preselected name is needed here
+    selected_infopen = request.form.get('infopen', selected_infopen)
 
     return render_template(
         'seeu.html',
         active_page='seeu',
         show_institutional_content=False,
         show_institutional_text=False,
-        users=users,
         judiciary_records=judiciary_records,
+        pagination=KeysetPage(judiciary_records, prev_cursor, next_cursor, total=None),
         selected_infopen=selected_infopen,
+        selected_nome=get_egresso_nome(selected_infopen.strip().upper()),
         # Pass filter values back to template to keep them in the form
         filter_infopen=filter_infopen,
         filter_nome=filter_nome,
@@ -635,7 +3266,7 @@ def edit_seeu(record_id):
 
     if request.method == 'POST':
         # Update record data
-        infopen = request.form.get('infopen')
+        infopen = request.form.get('infopen', '').strip().upper()
         data_notificacao = request.form.get('data_notificacao')
         numero_seeu = request.form.get('numero_seeu')
         protocolo = request.form.get('protocolo')
@@ -644,8 +3275,10 @@ def edit_seeu(record_id):
         # Validate required fields
         if not infopen:
             flash('O campo Infopen é obrigatório.', 'error')
-            users = UserRegistration.query.all()
-            return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, users=users)
+            return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, egresso_nome=get_egresso_nome(record.infopen))
+        if not get_egresso_nome(infopen):
+            flash('Nenhum egresso cadastrado com este Infopen.', 'error')
+            return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, egresso_nome=get_egresso_nome(record.infopen))
 
         # Convert date string to date object if provided
         from datetime import datetime
@@ -655,8 +3288,7 @@ def edit_seeu(record_id):
                 data_notificacao_obj = datetime.strptime(data_notificacao, '%Y-%m-%d').date()
             except ValueError:
                 flash('Formato de data inválido. Use AAAA-MM-DD.', 'error')
-                users = UserRegistration.query.all()
-                return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, users=users)
+                return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, egresso_nome=get_egresso_nome(record.infopen))
 
         record.infopen = infopen
         record.data_notificacao = data_notificacao_obj
@@ -672,8 +3304,7 @@ def edit_seeu(record_id):
             db.session.rollback()
             flash(f'Erro ao atualizar o registro judicial: {str(e)}', 'error')
 
-    users = UserRegistration.query.all()
-    return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, users=users)
+    return render_template('edit_seeu.html', active_page='seeu', show_institutional_content=False, record=record, egresso_nome=get_egresso_nome(record.infopen))
 
 
 @app.route('/delete_seeu/<int:record_id>', methods=['POST'])
@@ -692,85 +3323,54 @@ def delete_seeu(record_id):
     return redirect(url_for('seeu'))
 
 
-@app.route('/export_csv', methods=['POST'])
-def export_csv():
-    # Get filter values from the form (same as in search route)
-    infopen = request.form.get('infopen')
-    nome_completo = request.form.get('nome_completo')
-    cpf = request.form.get('cpf')
-    municipio = request.form.get('municipio')
-    ueop = request.form.get('ueop')
-    cia = request.form.get('cia')
-    data_modificacao = request.form.get('data_modificacao')
-    ano_modificacao = request.form.get('ano_modificacao')
-    mes_modificacao = request.form.get('mes_modificacao')
-
-    # Build query with filters, joining with images table
-    query = db.session.query(UserRegistration, Images.image_b64).outerjoin(
-        Images, UserRegistration.infopen == Images.infopen
-    )
-
-    if infopen:
-        query = query.filter(
-            UserRegistration.infopen.ilike(f'%{infopen}%'))
-    if nome_completo:
-        query = query.filter(
-            UserRegistration.nome_completo.ilike(f'%{nome_completo}%'))
-    if cpf:
-        query = query.filter(UserRegistration.cpf.ilike(f'%{cpf}%'))
-    if municipio:
-        query = query.filter(
-            UserRegistration.municipio.ilike(f'%{municipio}%'))
-    if ueop:
-        query = query.filter(UserRegistration.ueop.ilike(f'%{ueop}%'))
-    if cia:
-        query = query.filter(UserRegistration.cia.ilike(f'%{cia}%'))
-
-    # Date filters based on data_modificacao
-    if data_modificacao:
-        # Parse the date string and filter for that specific date
-        from datetime import datetime
-        try:
-            parsed_date = datetime.strptime(data_modificacao, '%Y-%m-%d').date()
-            query = query.filter(db.func.date(UserRegistration.data_modificacao) == parsed_date)
-        except ValueError:
-            flash('Formato de data inválido. Use AAAA-MM-DD.', 'error')
+# Rows fetched per round trip while exporting; keeps memory flat regardless of result size
+EXPORT_BATCH_SIZE = 200
 
-    if ano_modificacao:
-        try:
-            ano = int(ano_modificacao)
-            query = query.filter(db.extract('year', UserRegistration.data_modificacao) == ano)
-        except ValueError:
-            flash('Ano inválido. Use formato numérico (ex: 2026).', 'error')
+REGISTRATION_CSV_HEADER = [
+    'ID', 'Infopen', 'Nome Completo', 'CPF', 'Telefone', 'Rua', 'Bairro',
+    'Número', 'Município', 'UEOP', 'CIA', 'Restrições Judiciais',
+    'Observações', 'Latitude', 'Longitude', 'Data de Modificação', 'Imagem Base64'
+]
 
-    if mes_modificacao:
-        try:
-            mes = int(mes_modificacao)
-            query = query.filter(db.extract('month', UserRegistration.data_modificacao) == mes)
-        except ValueError:
-            flash('Mês inválido. Use formato numérico (1-12).', 'error')
+SEEU_CSV_HEADER = [
+    'Infopen', 'Nome', 'Data da Notificação', 'Número do SEEU',
+    'Protocolo', 'Anotações', 'Data do Registro'
+]
 
-    results = query.all()
 
-    # Generate CSV content with UTF-8 BOM encoding
+def iter_csv(header, rows, chunk_size=64 * 1024):
+    """Encode rows as CSV chunks of about chunk_size characters, starting with the UTF-8 BOM"""
     import csv
     import io
-    from flask import make_response
 
-    # Create a string buffer
-    output = io.StringIO()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # Add UTF-8 BOM so spreadsheet tools detect the encoding
+    buffer.write('\ufeff')
+    writer.writerow(header)
 
-    # Write header
-    writer = csv.writer(output)
-    writer.writerow([
-        'ID', 'Infopen', 'Nome Completo', 'CPF', 'Telefone', 'Rua', 'Bairro',
-        'Número', 'Município', 'UEOP', 'CIA', 'Restrições Judiciais',
-        'Observações', 'Latitude', 'Longitude', 'Data de Modificação', 'Imagem Base64'
-    ])
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
+def iter_registration_rows(filters):
+    """Yield the CSV rows of the registrations matching filters, fetched in batches"""
+    # Build query with filters, joining with the image tables
+    query = db.session.query(UserRegistration, ImageBlob.data, Images.image_b64).outerjoin(
+        Images, UserRegistration.infopen == Images.infopen
+    ).outerjoin(
+        ImageBlob, Images.image_hash == ImageBlob.image_hash
+    )
+    query = apply_search_filters(query, filters).order_by(UserRegistration.id)
 
-    # Write data rows
-    for user, image_b64 in results:
-        writer.writerow([
+    for user, image_data, image_b64 in query.yield_per(EXPORT_BATCH_SIZE):
+        yield [
             user.id,
             user.infopen or '',
             user.nome_completo or '',
@@ -788,24 +3388,176 @@ def export_csv():
             user.longitude or '',
             user.data_modificacao.strftime(
                 '%d/%m/%Y %H:%M:%S') if user.data_modificacao else '',
-            image_b64 or ''  # Include image_b64, empty if not available
-        ])
+            # Image as Base64 (legacy rows already hold it), empty if not available
+            base64.b64encode(image_data).decode('ascii') if image_data else (image_b64 or '')
+        ]
+        # Drop the batch from the identity map once it has been written
+        db.session.expunge(user)
 
-    # Get the CSV content as string
-    csv_content = output.getvalue()
-    output.close()
 
-    # Add UTF-8 BOM to the content
-    csv_content_with_bom = '\ufeff' + csv_content
+def csv_download(chunks, filename):
+    """Chunked CSV response that keeps the request context open while streaming"""
+    from flask import Response, stream_with_context
 
-    # Create response with CSV content
-    response = make_response(csv_content_with_bom)
+    response = Response(stream_with_context(chunks), mimetype='text/csv')
     response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    response.headers['Content-Disposition'] = 'attachment; filename=registros_exportados.csv'
-
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 
 
+# Export jobs run in a small local pool; their state lives in EXPORT_DIR so every
+# worker process can report on (and reuse) a job started by another one
+EXPORT_EXECUTOR = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+EXPORT_JOBS_LOCK = threading.Lock()
+RUNNING_EXPORTS = set()
+
+# A job whose status file hasn't been touched for this long is assumed dead and restarted
+EXPORT_STALE_AFTER = 600  # seconds
+
+
+def export_job_id(filters):
+    """Key of an export: the same filters over the same data version give the same file"""
+    payload = json.dumps({
+        'filters': sorted(filters.items()),
+        'version': get_data_version('user_registration'),
+    })
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def export_job_paths(job_id):
+    base = os.path.join(EXPORT_DIR, job_id)
+    return base + '.csv', base + '.json'
+
+
+def write_export_status(job_id, **status):
+    _, status_path = export_job_paths(job_id)
+    temp_path = f'{status_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f)
+    os.replace(temp_path, status_path)
+
+
+def read_export_status(job_id):
+    artifact_path, status_path = export_job_paths(job_id)
+    if os.path.exists(artifact_path):
+        return {'state': 'done'}
+    try:
+        with open(status_path, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if status.get('state') in ('queued', 'running') and \
+            time.time() - os.path.getmtime(status_path) > EXPORT_STALE_AFTER:
+        return None
+    return status
+
+
+def prune_export_artifacts():
+    """Remove export files older than EXPORT_ARTIFACT_TTL"""
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_ARTIFACT_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def run_export_job(job_id, filters):
+    artifact_path, _ = export_job_paths(job_id)
+    partial_path = f'{artifact_path}.{os.getpid()}.part'
+    try:
+        with app.app_context():
+            query = apply_search_filters(UserRegistration.query, filters)
+            total = query.with_entities(db.func.count(UserRegistration.id)).scalar()
+            write_export_status(job_id, state='running', rows=0, total=total)
+
+            def rows_with_progress():
+                for written, row in enumerate(iter_registration_rows(filters), start=1):
+                    yield row
+                    if written % 1000 == 0:
+                        write_export_status(job_id, state='running', rows=written, total=total)
+
+            with open(partial_path, 'w', encoding='utf-8', newline='') as f:
+                for chunk in iter_csv(REGISTRATION_CSV_HEADER, rows_with_progress()):
+                    f.write(chunk)
+            os.replace(partial_path, artifact_path)
+            write_export_status(job_id, state='done', rows=total, total=total)
+    except Exception as e:
+        app.logger.exception('Export job %s failed', job_id)
+        write_export_status(job_id, state='error', error=str(e))
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    finally:
+        with EXPORT_JOBS_LOCK:
+            RUNNING_EXPORTS.discard(job_id)
+
+
+def enqueue_export(filters):
+    """Start an export job unless an identical one is finished or already running"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    job_id = export_job_id(filters)
+
+    with EXPORT_JOBS_LOCK:
+        status = read_export_status(job_id)
+        if job_id in RUNNING_EXPORTS or (status and status['state'] != 'error'):
+            return job_id
+        RUNNING_EXPORTS.add(job_id)
+
+    prune_export_artifacts()
+    write_export_status(job_id, state='queued', rows=0, total=None)
+    EXPORT_EXECUTOR.submit(run_export_job, job_id, filters)
+    return job_id
+
+
+def get_export_job_or_404(job_id):
+    from flask import abort
+
+    # Job ids are hex digests; anything else could point outside EXPORT_DIR
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        abort(404)
+    status = read_export_status(job_id)
+    if status is None:
+        abort(404)
+    return status
+
+
+@app.route('/export_csv', methods=['POST'])
+def export_csv():
+    # Get filter values from the form (same as in search route)
+    filters = get_search_filters(request.form)
+    job_id = enqueue_export(filters)
+    return redirect(url_for('export_job', job_id=job_id))
+
+
+@app.route('/export_jobs/<job_id>')
+def export_job(job_id):
+    status = get_export_job_or_404(job_id)
+    return render_template('export_job.html', active_page='search', show_institutional_content=False,
+                           job_id=job_id, status=status)
+
+
+@app.route('/export_jobs/<job_id>/status')
+def export_job_status(job_id):
+    status = get_export_job_or_404(job_id)
+    if status['state'] == 'done':
+        status['download_url'] = url_for('download_export', job_id=job_id)
+    return status
+
+
+@app.route('/export_jobs/<job_id>/download')
+def download_export(job_id):
+    from flask import abort, send_file
+
+    status = get_export_job_or_404(job_id)
+    if status['state'] != 'done':
+        abort(404)
+    artifact_path, _ = export_job_paths(job_id)
+    return send_file(artifact_path, mimetype='text/csv', as_attachment=True,
+                     download_name='registros_exportados.csv', max_age=0)
+
+
 @app.route('/export_seeu_csv', methods=['GET'])
 def export_seeu_csv():
     # Get filter parameters from the URL (same as in seeu route)
@@ -813,15 +3565,12 @@ def export_seeu_csv():
     filter_nome = request.args.get('filter_nome', '').strip()
     filter_numero_seeu = request.args.get('filter_numero_seeu', '').strip()
 
-    # Start with a base query on the Judiciary table
-    query = Judiciary.query
+    # Fetch each record together with its egresso name in a single query
+    query = db.session.query(Judiciary, UserRegistration.nome_completo).outerjoin(
+        UserRegistration, Judiciary.infopen == UserRegistration.infopen)
 
-    # Conditionally join with UserRegistration only if filtering by name
     if filter_nome:
-        query = query.join(
-            UserRegistration, Judiciary.infopen == UserRegistration.infopen)
-        query = query.filter(
-            UserRegistration.nome_completo.ilike(f'%{filter_nome}%'))
+        query = query.filter(search_filter('nome_completo', filter_nome))
 
     # Apply infopen filter if provided
     if filter_infopen:
@@ -831,55 +3580,482 @@ def export_seeu_csv():
     if filter_numero_seeu:
         query = query.filter(Judiciary.numero_seeu.ilike(f'%{filter_numero_seeu}%'))
 
-    # Execute the final query
-    judiciary_records = query.order_by(Judiciary.data_registro.desc()).all()
+    query = query.order_by(Judiciary.data_registro.desc())
+
+    def iter_seeu_rows():
+        for record, nome_completo in query.yield_per(EXPORT_BATCH_SIZE):
+            yield [
+                record.infopen or '',
+                nome_completo or '',
+                record.data_notificacao.strftime('%d/%m/%Y') if record.data_notificacao else '',
+                record.numero_seeu or '',
+                record.protocolo or '',
+                record.anotacoes or '',
+                record.data_registro.strftime('%d/%m/%Y %H:%M:%S') if record.data_registro else ''
+            ]
+
+    return csv_download(iter_csv(SEEU_CSV_HEADER, iter_seeu_rows()), 'registros_seeu_exportados.csv')
+
+
+# Bulk import: accepted column names (model field or export header label) -> field
+IMPORT_BATCH_SIZE = 500
+IMPORT_COLUMN_NAMES = {
+    **{field: field for field in REGISTRATION_INPUT_FIELDS},
+    **dict(zip(REGISTRATION_CSV_HEADER[1:15], REGISTRATION_INPUT_FIELDS)),
+}
+
+
+def format_cpf(value):
+    """CPF as 000.000.000-00 when it has exactly 11 digits, otherwise as typed"""
+    digits = only_digits(value)
+    if digits and len(digits) == 11:
+        return f'{digits[:3]}.{digits[3:6]}.{digits[6:9]}-{digits[9:]}'
+    return value
+
 
-    # Generate CSV content with UTF-8 BOM encoding
+def iter_import_records(stream, file_format):
+    """Yield (line number, {field: value}) from a CSV or JSONL text stream"""
+    import csv
+
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record if isinstance(record, dict) else None
+
+
+def read_import_record(record):
+    """Input fields of an import record keyed by field name, dropping unknown columns"""
+    values = {}
+    for name, value in (record or {}).items():
+        field = IMPORT_COLUMN_NAMES.get((name or '').strip().lstrip('\ufeff'))
+        if field and value not in (None, ''):
+            values[field] = str(value).strip() or None
+    return values
+
+
+def prepare_import_row(record):
+    """Normalized column values of an import record, or an error message"""
+    if record is None:
+        return 'Linha inválida.'
+
+    values = read_import_record(record)
+    if not values.get('infopen'):
+        return 'Infopen é obrigatório.'
+    if not values.get('nome_completo'):
+        return 'Nome completo é obrigatório.'
+    values['cpf'] = format_cpf(values.get('cpf'))
+    values = normalize_registration(values)
+
+    # PostgreSQL would reject the whole batch over a single value that is too long
+    for field in REGISTRATION_INPUT_FIELDS:
+        max_length = getattr(UserRegistration.__table__.c[field].type, 'length', None)
+        if max_length and values.get(field) and len(values[field]) > max_length:
+            return f'{field} excede {max_length} caracteres.'
+    return values
+
+
+def copy_registrations(connection, rows):
+    """Insert rows with PostgreSQL COPY, the fastest path for large batches"""
     import csv
     import io
-    from flask import make_response
 
-    # Create a string buffer
-    output = io.StringIO()
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY user_registration ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def insert_registrations(rows):
+    """Insert already normalized rows in one statement and invalidate the caches"""
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        copy_registrations(connection, rows)
+    else:
+        # executemany; Core inserts skip the ORM listeners, which the rows went through already
+        connection.execute(UserRegistration.__table__.insert(), rows)
+    add_registrations_to_summary(connection, rows)
+    log_inserted_registrations(connection, rows)
+    bump_data_version(connection, 'user_registration')
+
+
+def import_registration_batch(batch, report):
+    """Check the infopens of a batch with one query and insert the new rows"""
+    infopens = [values['infopen'] for _, values in batch]
+    existing = {infopen for infopen, in db.session.query(UserRegistration.infopen).filter(
+        UserRegistration.infopen.in_(infopens))}
+
+    rows = []
+    for line_number, values in batch:
+        if values['infopen'] in existing:
+            report['errors'].append({'linha': line_number, 'infopen': values['infopen'],
+                                     'erro': 'Egresso já cadastrado.'})
+        else:
+            rows.append(values)
+    if not rows:
+        return
 
-    # Write header - match the visible columns in the seeu table
-    writer = csv.writer(output)
-    writer.writerow([
-        'Infopen', 'Nome', 'Data da Notificação', 'Número do SEEU',
-        'Protocolo', 'Anotações', 'Data do Registro'
-    ])
+    now = get_current_time_brasilia()
+    for values in rows:
+        values['data_modificacao'] = now
+        for field in REGISTRATION_INPUT_FIELDS:
+            values.setdefault(field, None)
 
-    # Write data rows
-    for record in judiciary_records:
-        # Get the associated user to get the name
-        user = UserRegistration.query.filter_by(infopen=record.infopen).first()
-
-        writer.writerow([
-            record.infopen or '',
-            user.nome_completo if user else '',
-            record.data_notificacao.strftime('%d/%m/%Y') if record.data_notificacao else '',
-            record.numero_seeu or '',
-            record.protocolo or '',
-            record.anotacoes or '',
-            record.data_registro.strftime('%d/%m/%Y %H:%M:%S') if record.data_registro else ''
-        ])
-
-    # Get the CSV content as string
-    csv_content = output.getvalue()
-    output.close()
-
-    # Add UTF-8 BOM to the content
-    csv_content_with_bom = '\ufeff' + csv_content
-
-    # Create response with CSV content
-    response = make_response(csv_content_with_bom)
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-    response.headers['Content-Disposition'] = 'attachment; filename=registros_seeu_exportados.csv'
+    try:
+        insert_registrations(rows)
+        db.session.commit()
+        report['inserted'] += len(rows)
+    except Exception:
+        # A concurrent insert or a database-level constraint: redo the batch row by row
+        db.session.rollback()
+        line_numbers = {id(values): line_number for line_number, values in batch}
+        for values in rows:
+            try:
+                insert_registrations([values])
+                db.session.commit()
+                report['inserted'] += 1
+            except Exception as e:
+                db.session.rollback()
+                report['errors'].append({'linha': line_numbers[id(values)], 'infopen': values['infopen'],
+                                         'erro': str(getattr(e, 'orig', e))})
+
+
+def import_registrations(stream, file_format, batch_size=IMPORT_BATCH_SIZE):
+    """Import registrations from a CSV/JSONL text stream in batches
+
+    Bad rows are reported and skipped; every valid row is kept. Returns
+    {'inserted': n, 'errors': [{'linha', 'infopen', 'erro'}]}.
+    """
+    report = {'inserted': 0, 'errors': []}
+    batch = []
+    seen = set()
+    for line_number, record in iter_import_records(stream, file_format):
+        values = prepare_import_row(record)
+        if isinstance(values, str):
+            report['errors'].append({'linha': line_number, 'infopen': read_import_record(record).get('infopen'),
+                                     'erro': values})
+            continue
+        if values['infopen'] in seen:
+            report['errors'].append({'linha': line_number, 'infopen': values['infopen'],
+                                     'erro': 'Infopen repetido no arquivo.'})
+            continue
+        seen.add(values['infopen'])
+        batch.append((line_number, values))
+
+        if len(batch) >= batch_size:
+            import_registration_batch(batch, report)
+            batch = []
+    if batch:
+        import_registration_batch(batch, report)
+
+    report['errors'].sort(key=lambda error: error['linha'])
+    return report
+
+
+def import_file_format(filename, requested=None):
+    """'csv' or 'jsonl' from an explicit choice or the file extension, or None"""
+    file_format = (requested or os.path.splitext(filename or '')[1].lstrip('.')).lower()
+    if file_format == 'json':
+        file_format = 'jsonl'
+    return file_format if file_format in ('csv', 'jsonl') else None
+
+
+@app.route('/import_registrations', methods=['POST'])
+@query_budget(None)
+def import_registrations_upload():
+    """Bulk import of an uploaded CSV/JSONL file, answered with a per-row error report"""
+    import io
 
-    return response
+    file = request.files.get('arquivo')
+    if not file or not file.filename:
+        return {'error': 'Envie o arquivo no campo "arquivo".'}, 400
+    file_format = import_file_format(file.filename, request.form.get('formato'))
+    if not file_format:
+        return {'error': 'Formato não suportado. Use CSV ou JSONL.'}, 400
+
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+    return import_registrations(stream, file_format)
+
+
+def explain_query(query):
+    """Query plan lines of a query, as reported by the database's EXPLAIN"""
+    explain_prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+
+    def add_explain_prefix(conn, cursor, statement, parameters, context, executemany):
+        return explain_prefix + statement, parameters
+
+    # Run the real statement (same parameters and types) with EXPLAIN in front of it
+    with db.engine.connect() as connection:
+        event.listen(connection, 'before_cursor_execute', add_explain_prefix, retval=True)
+        rows = connection.execute(query.statement).all()
+    return [str(row[-1]) for row in rows]
+
+
+def full_scan_lines(plan):
+    """Plan lines reading the whole user_registration table"""
+    return [line for line in plan
+            if re.search(r'\bSCAN user_registration\b(?!_)', line)
+            or 'Seq Scan on user_registration' in line]
+
+
+def standard_filter_sets():
+    """The filter combinations officers actually use on /search and /export_csv"""
+    reference_data = REFERENCE_DATA.current()
+    ueop = next(iter(reference_data.enterprise_data))
+    cia = reference_data.enterprise_data[ueop][0]
+    municipio = reference_data.municipalities[0]
+    today = get_current_time_brasilia()
+    return [
+        {'ueop': ueop},
+        {'ueop': ueop, 'cia': cia},
+        {'cia': cia},
+        {'municipio': municipio},
+        {'ueop': ueop, 'cia': cia, 'ano_modificacao': str(today.year), 'mes_modificacao': str(today.month)},
+        {'ueop': ueop, 'data_modificacao': today.strftime('%Y-%m-%d')},
+        {'municipio': municipio, 'ano_modificacao': str(today.year)},
+        {'data_modificacao': today.strftime('%Y-%m-%d')},
+        {'ano_modificacao': str(today.year)},
+        {'ano_modificacao': str(today.year), 'mes_modificacao': str(today.month)},
+        {'mes_modificacao': str(today.month)},
+        {'nome_completo': 'SILVA'},
+        {'infopen': '123'},
+        {'cpf': '123.456'},
+    ]
+
+
+def standard_bbox():
+    """A map viewport of about 10 km around a registered egresso (Belo Horizonte if none)"""
+    point = db.session.query(UserRegistration.latitude_num, UserRegistration.longitude_num).filter(
+        UserRegistration.latitude_num.isnot(None)).first() or (-19.92, -43.94)
+    return point[0] - 0.05, point[1] - 0.05, point[0] + 0.05, point[1] + 0.05
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if a standard /search filter combination or the map bounding box query needs a full table scan
+
+    PostgreSQL prefers sequential scans on tiny tables, so run this against a
+    database with realistic volume (e.g. one filled by the benchmark generator).
+    """
+    failures = 0
+    for filters in standard_filter_sets():
+        query = apply_search_filters(UserRegistration.query, filters).with_entities(
+            db.func.count(UserRegistration.id))
+        plan = explain_query(query)
+        scans = full_scan_lines(plan)
+        status = 'FULL SCAN' if scans else 'ok'
+        click.echo(f'{status:9} {sorted(filters)}')
+        for line in plan:
+            click.echo(f'          {line}')
+        failures += bool(scans)
+
+    bbox = standard_bbox()
+    plan = explain_query(find_in_bbox(*bbox).with_entities(*GEO_RESULT_COLUMNS))
+    scans = full_scan_lines(plan)
+    click.echo(f"{'FULL SCAN' if scans else 'ok':9} bbox {', '.join(f'{value:.2f}' for value in bbox)}")
+    for line in plan:
+        click.echo(f'          {line}')
+    failures += bool(scans)
+
+    if failures:
+        raise click.ClickException(f'{failures} consulta(s) sem índice.')
+
+
+@app.cli.command('migrate-images')
+@click.option('--batch-size', default=200, show_default=True, help='Rows converted per transaction.')
+@click.option('--vacuum', is_flag=True, help='Run VACUUM afterwards to give the space back (SQLite).')
+def migrate_images(batch_size, vacuum):
+    """Move legacy Base64 images into the binary blob store"""
+    converted = 0
+    last_id = 0
+    while True:
+        # Walk the table by primary key so each batch is a cheap range scan
+        batch = Images.query.filter(
+            Images.id > last_id, Images.image_b64 != ''
+        ).order_by(Images.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        for image_record in batch:
+            file_content = base64.b64decode(image_record.image_b64)
+            blob = get_or_create_image_blob(file_content)
+            image_record.image_hash = blob.image_hash
+            image_record.image_b64 = ''
+            # Make the new blob visible to the next rows of the batch (deduplication)
+            db.session.flush()
+
+        last_id = batch[-1].id
+        converted += len(batch)
+        db.session.commit()
+        db.session.expunge_all()
+        click.echo(f'{converted} imagens convertidas...')
+
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+
+    click.echo(f'Migração concluída: {converted} imagens convertidas.')
+
+
+geocode_cli = AppGroup('geocode', help='Gerencia o cache de geocodificação.')
+app.cli.add_command(geocode_cli)
+
+
+def load_gazetteer():
+    if not os.path.exists(GAZETTEER_JSON_PATH):
+        return []
+    with open(GAZETTEER_JSON_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def gazetteer_address(municipio, bairro=None):
+    return f'{bairro}, {municipio}' if bairro else municipio
+
+
+@geocode_cli.command('seed')
+@click.option('--min-registros', default=3, show_default=True,
+              help='Registrations needed to place a municipality or bairro at their centroid.')
+@click.option('--upstream', is_flag=True,
+              help='Ask the upstream geocoder for municipalities still missing (1 request/s).')
+def geocode_seed(min_registros, upstream):
+    """Seed the cache with the municipalities of cityzen.json and their bairros"""
+    municipalities = REFERENCE_DATA.current().municipalities
+    seeded = set()
+
+    # 1. Offline gazetteer file, authoritative
+    for place in load_gazetteer():
+        address = gazetteer_address(place['MUNICIPIO'], place.get('BAIRRO'))
+        store_geocode(address, (float(place['LATITUDE']), float(place['LONGITUDE']), address), 'gazetteer')
+        seeded.add(normalize_address(address))
+    click.echo(f'{len(seeded)} lugares do gazetteer.')
+
+    # 2. Centroids of the registrations already placed on the map
+    from_registrations = 0
+    for group_columns in ((UserRegistration.municipio,), (UserRegistration.municipio, UserRegistration.bairro)):
+        centroids = db.session.query(
+            *group_columns, db.func.avg(UserRegistration.latitude_num), db.func.avg(UserRegistration.longitude_num)
+        ).filter(
+            UserRegistration.municipio.in_(municipalities),
+            UserRegistration.latitude_num.isnot(None),
+            *[column.isnot(None) for column in group_columns]
+        ).group_by(*group_columns).having(db.func.count(UserRegistration.id) >= min_registros).all()
+        for *place, latitude, longitude in centroids:
+            address = gazetteer_address(*place)
+            if normalize_address(address) not in seeded:
+                store_geocode(address, (latitude, longitude, address), 'registros')
+                seeded.add(normalize_address(address))
+                from_registrations += 1
+    click.echo(f'{from_registrations} lugares pelo centro dos registros.')
+
+    # 3. Upstream geocoder for the municipalities nobody placed yet
+    missing = [municipio for municipio in municipalities if normalize_address(municipio) not in seeded]
+    geocoder = get_upstream_geocoder() if upstream else None
+    if geocoder:
+        for municipio in missing:
+            coordinates = geocoder.search(f'{municipio}, Minas Gerais, Brasil')
+            if coordinates:
+                store_geocode(municipio, coordinates, 'upstream')
+                seeded.add(normalize_address(municipio))
+            time.sleep(1)  # Nominatim usage policy
+        missing = [municipio for municipio in municipalities if normalize_address(municipio) not in seeded]
+
+    if missing:
+        click.echo(f'Municípios sem coordenadas: {", ".join(missing)}')
+    click.echo(f'Cache de geocodificação com {GeocodeCache.query.count()} endereços.')
+
+
+@app.cli.command('import-registrations')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True, help='Rows inserted per statement.')
+@click.option('--report', 'report_path', type=click.Path(dir_okay=False), help='Write the rejected rows to this CSV.')
+def import_registrations_command(path, file_format, batch_size, report_path):
+    """Bulk import registrations from a CSV or JSONL file"""
+    file_format = import_file_format(path, file_format)
+    if not file_format:
+        raise click.ClickException('Formato não suportado. Use --format csv ou jsonl.')
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        report = import_registrations(f, file_format, batch_size)
+
+    click.echo(f"{report['inserted']} registros importados, {len(report['errors'])} rejeitados.")
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in iter_csv(['Linha', 'Infopen', 'Erro'], (
+                    [error['linha'], error['infopen'] or '', error['erro']] for error in report['errors'])):
+                f.write(chunk)
+    else:
+        for error in report['errors']:
+            click.echo(f"linha {error['linha']}: {error['infopen'] or '-'}: {error['erro']}")
+
+
+@app.cli.command('duplicates-report')
+@click.option('--output', 'output_path', type=click.Path(dir_okay=False), help='Write the pairs to this CSV.')
+def duplicates_report_command(output_path):
+    """List possible duplicate registrations: same CPF, same photo or similar name in the same município"""
+    pairs, truncated = duplicate_report()
+    pairs.sort(key=lambda pair: (pair[2], -pair[3], pair[0].nome_completo))
+    click.echo(f'{len(pairs)} pares de possíveis duplicados.')
+    for block, total in truncated:
+        click.echo(f'Bloco {block}: {total} cadastros, comparados só os {DUPLICATE_BLOCK_LIMIT} mais antigos.')
+    header = ['Motivo', 'Similaridade', 'Infopen', 'Nome', 'Município',
+              'Infopen duplicado', 'Nome duplicado', 'Município duplicado']
+    lines = ([motivo, f'{similarity:.2f}', row.infopen or '', row.nome_completo, row.municipio or '',
+              other.infopen or '', other.nome_completo, other.municipio or '']
+             for row, other, motivo, similarity in pairs)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in iter_csv(header, lines):
+                f.write(chunk)
+    else:
+        for line in lines:
+            click.echo(' | '.join(line))
+
+
+@app.cli.command('process-images')
+def process_images_command():
+    """Re-encode the stored images still kept as uploaded (older uploads, jobs lost in a restart)"""
+    image_hashes = [image_hash for image_hash, in
+                    db.session.query(ImageBlob.image_hash).filter(ImageBlob.source_hash.is_(None))]
+    for done, image_hash in enumerate(image_hashes, start=1):
+        process_image_blob(image_hash)
+        if done % 100 == 0:
+            click.echo(f'{done} / {len(image_hashes)} imagens...')
+    click.echo(f'{len(image_hashes)} imagens reprocessadas.')
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Build the optimized, fingerprinted copies of the images in static/"""
+    manifest = build_static_assets(click.echo)
+    click.echo(f'{len(manifest)} assets no manifesto.')
+
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Recompute the dashboard summary tables from the registrations and SEEU records"""
+    rebuild_summaries()
+    db.session.commit()
+    click.echo(f'{RegistrationSummary.query.count()} grupos de cadastros e '
+               f'{JudiciarySummary.query.count()} meses do SEEU recalculados.')
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)
+    # The development server keeps the schema up to date on its own
+    app.config['AUTO_MIGRATE'] = True
+    create_app().run(host='0.0.0.0', debug=True)
 
 
@@ -0,0 +1,381 @@
+"""Benchmark harness: seeded synthetic data and latency measurements of the main routes
+
+    python benchmark.py seed --scale 10k        # fill DATABASE_URL with synthetic data
+    python benchmark.py run --output results.json
+    python benchmark.py compare old.json new.json
+
+Use a dedicated database (e.g. DATABASE_URL=sqlite:///bench.db): seeding appends
+thousands of rows. Runs are reproducible: the same --seed and --scale always
+generate the same data, and every run records the commit it measured.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from PIL import Image as PILImage
+
+from app import (
+    app, db, create_app, Images, ImageBlob, Judiciary, UserRegistration, REFERENCE_DATA,
+    load_cityzen_data, normalize_registration, insert_registrations, bump_data_version, rebuild_summaries,
+    log_changes, change_data,
+    detect_image_mimetype, world_pixel
+)
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+FIRST_NAMES = [
+    'JOSÉ', 'JOÃO', 'ANTÔNIO', 'FRANCISCO', 'CARLOS', 'PAULO', 'PEDRO', 'LUCAS', 'LUIZ', 'MARCOS',
+    'LUÍS', 'GABRIEL', 'RAFAEL', 'DANIEL', 'MARCELO', 'BRUNO', 'EDUARDO', 'FELIPE', 'RAIMUNDO', 'RODRIGO',
+    'MARIA', 'ANA', 'FRANCISCA', 'ANTÔNIA', 'ADRIANA', 'JULIANA', 'MÁRCIA', 'FERNANDA', 'PATRÍCIA', 'ALINE',
+]
+SURNAMES = [
+    'SILVA', 'SANTOS', 'OLIVEIRA', 'SOUZA', 'RODRIGUES', 'FERREIRA', 'ALVES', 'PEREIRA', 'LIMA', 'GOMES',
+    'COSTA', 'RIBEIRO', 'MARTINS', 'CARVALHO', 'ALMEIDA', 'LOPES', 'SOARES', 'FERNANDES', 'VIEIRA', 'BARBOSA',
+    'ROCHA', 'DIAS', 'NASCIMENTO', 'ANDRADE', 'MOREIRA', 'NUNES', 'MARQUES', 'MACHADO', 'MENDES', 'FREITAS',
+]
+STREETS = ['RUA GOIÁS', 'RUA SÃO PAULO', 'AVENIDA PRIMEIRO DE JUNHO', 'RUA RIO DE JANEIRO', 'RUA PERNAMBUCO',
+           'AVENIDA AMAZONAS', 'RUA MINAS GERAIS', 'RUA ITAPECERICA', 'RUA SERGIPE', 'RUA PARÁ']
+BAIRROS = ['CENTRO', 'SÃO JOSÉ', 'BOM PASTOR', 'NITERÓI', 'SANTA CLARA', 'PLANALTO', 'JARDIM BELVEDERE',
+           'SIDIL', 'ESPLANADA', 'PORTO VELHO']
+
+# Region covered by the municipalities of cityzen.json
+REGION = {'south': -21.0, 'north': -18.8, 'west': -46.2, 'east': -44.2}
+
+IMAGE_RATIO = 0.6        # registrations with a profile photo
+JUDICIARY_RATIO = 0.5    # SEEU records per registration
+PHOTO_POOL_SIZE = 500    # distinct photos (the blob store deduplicates identical ones)
+INSERT_BATCH_SIZE = 5000
+
+
+def generate_photo(rng):
+    """JPEG of a typical phone photo size (~600x800, tens of KB)"""
+    width, height = 600, 800
+    base = PILImage.new('RGB', (width // 8, height // 8),
+                        tuple(rng.randrange(40, 220) for _ in range(3)))
+    noise = PILImage.effect_noise((width // 8, height // 8), rng.randrange(20, 60)).convert('RGB')
+    image = PILImage.blend(base, noise, 0.5).resize((width, height), PILImage.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def generate_registration(rng, number, places, now):
+    municipio, ueop = rng.choice(places)
+    enterprise_data = REFERENCE_DATA.current().enterprise_data
+    cpf = ''.join(str(rng.randrange(10)) for _ in range(11))
+    latitude = rng.uniform(REGION['south'], REGION['north'])
+    longitude = rng.uniform(REGION['west'], REGION['east'])
+    values = normalize_registration({
+        'infopen': f'BENCH{number:07d}',
+        'nome_completo': ' '.join([rng.choice(FIRST_NAMES), rng.choice(SURNAMES), rng.choice(SURNAMES)]),
+        'cpf': f'{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}',
+        'telefone': f'(37) 9{rng.randrange(10**7, 10**8)}',
+        'rua': rng.choice(STREETS),
+        'bairro': rng.choice(BAIRROS),
+        'numero': str(rng.randrange(1, 3000)),
+        'municipio': municipio,
+        'ueop': ueop,
+        'cia': rng.choice(enterprise_data.get(ueop, ['OUTRA'])),
+        'restricoes_judiciais': rng.choice([None, 'RECOLHIMENTO NOTURNO', 'PROIBIDO DE SE AUSENTAR DA COMARCA']),
+        'observacoes': None,
+        'latitude': f'{latitude:.6f}',
+        'longitude': f'{longitude:.6f}',
+    })
+    values['data_modificacao'] = now - timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+    return values
+
+
+@click.group()
+def cli():
+    """Benchmark harness for the IAAP Saídas routes"""
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(list(SCALES)), default='10k', show_default=True)
+@click.option('--seed', default=42, show_default=True, help='Random seed; same seed, same data.')
+def seed(scale, seed):
+    """Fill the database with synthetic registrations, photos and SEEU records"""
+    total = SCALES[scale]
+    places = [(item['MUNICIPIO'], item['UEOP']) for item in load_cityzen_data()]
+    now = datetime(2026, 1, 1)
+
+    with app.app_context():
+        # A larger scale extends a smaller one: rows are numbered and each has its own seed
+        start = UserRegistration.query.filter(UserRegistration.infopen.like('BENCH%')).count()
+        if start >= total:
+            click.echo(f'O banco já tem {start} registros sintéticos.')
+            return
+
+        photo_rng = random.Random(seed)
+        photo_hashes = []
+        for _ in range(PHOTO_POOL_SIZE):
+            photo = generate_photo(photo_rng)
+            image_hash = hashlib.sha256(photo).hexdigest()
+            db.session.merge(ImageBlob(image_hash=image_hash, data=photo,
+                                       mimetype=detect_image_mimetype(photo), size=len(photo)))
+            photo_hashes.append(image_hash)
+        db.session.commit()
+
+        for batch_start in range(start, total, INSERT_BATCH_SIZE):
+            numbers = range(batch_start, min(batch_start + INSERT_BATCH_SIZE, total))
+            rows, images, records = [], [], []
+            for number in numbers:
+                rng = random.Random(f'{seed}-{number}')
+                row = generate_registration(rng, number, places, now)
+                rows.append(row)
+                if rng.random() < IMAGE_RATIO:
+                    images.append({'infopen': row['infopen'], 'image_b64': '',
+                                   'image_hash': rng.choice(photo_hashes), 'created_at': row['data_modificacao']})
+                if rng.random() < JUDICIARY_RATIO:
+                    records.append({
+                        'infopen': row['infopen'],
+                        'data_notificacao': (row['data_modificacao'] - timedelta(days=rng.randrange(30))).date(),
+                        'numero_seeu': f'{rng.randrange(10**6, 10**7)}-{rng.randrange(10, 99)}.2025.8.13.0223',
+                        'protocolo': str(rng.randrange(10**8)),
+                        'anotacoes': None,
+                        'data_registro': row['data_modificacao'],
+                    })
+
+            insert_registrations(rows)
+            connection = db.session.connection()
+            if images:
+                connection.execute(Images.__table__.insert(), images)
+            if records:
+                judiciary = Judiciary.__table__
+                connection.execute(judiciary.insert(), records)
+                # Core inserts skip the change log hooks, like the summary ones below
+                saved = connection.execute(db.select(judiciary).where(
+                    judiciary.c.infopen.in_([record['infopen'] for record in records])))
+                log_changes(connection, 'judiciary', 'insert',
+                            [(row.id, change_data('judiciary', row._mapping)) for row in saved])
+                bump_data_version(connection, 'judiciary')
+            db.session.commit()
+            click.echo(f'{numbers.stop} / {total} registros...')
+
+        # The SEEU records went in through Core inserts, which the summary hooks don't see
+        rebuild_summaries()
+        db.session.commit()
+
+    click.echo('Dados sintéticos gerados.')
+
+
+class TestClientDriver:
+    """Requests through the Flask test client, in process"""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.headers, response.get_data()
+
+
+class HttpDriver:
+    """Requests to a running server, e.g. gunicorn -c gunicorn.conf.py wsgi:app"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        http_request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+
+def sql_query_count(headers):
+    """Statements run by the request, read from the Server-Timing header"""
+    timing = headers.get('Server-Timing', '')
+    if 'queries' not in timing:
+        return None
+    return int(timing.split('"')[1].split()[0])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def wait_for_export(driver, job_path, timeout=600):
+    """Poll an export job until it finishes; its final HTTP-like status"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, _, body = driver.request('GET', f'{job_path}/status')
+        if status != 200:
+            return status
+        state = json.loads(body)['state']
+        if state == 'done':
+            return 200
+        if state == 'error':
+            return 500
+        time.sleep(0.05)
+    return 504
+
+
+def measure(driver, requests, concurrency):
+    """Send (method, path, data) requests and summarize latency, throughput and SQL counts"""
+    latencies, query_counts, errors = [], [], 0
+
+    def send(item):
+        method, path, data = item
+        start = time.perf_counter()
+        status, headers, _ = driver.request(method, path, data)
+        queries = sql_query_count(headers)
+        location = headers.get('Location') or ''
+        if status == 302 and '/export_jobs/' in location:
+            # Background export: the latency that matters is until the file is ready
+            status = wait_for_export(driver, urllib.parse.urlsplit(location).path)
+        return time.perf_counter() - start, status, queries
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, status, queries in executor.map(send, requests):
+            latencies.append(latency * 1000)
+            errors += status >= 400
+            if queries is not None:
+                query_counts.append(queries)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'sql_queries_mean': round(statistics.mean(query_counts), 1) if query_counts else None,
+        'sql_queries_max': max(query_counts) if query_counts else None,
+        # High-water mark of this process; only meaningful for the test client driver
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def scenario_requests(rng, count):
+    """The requests of each scenario, drawn from the seeded data"""
+    with app.app_context():
+        total = UserRegistration.query.filter(UserRegistration.infopen.like('BENCH%')).count()
+        with_image = [infopen for infopen, in db.session.query(Images.infopen).filter(
+            Images.infopen.like('BENCH%')).limit(1000)]
+    if not total:
+        raise click.ClickException('Nenhum dado sintético; execute `python benchmark.py seed` antes.')
+
+    def some_infopen():
+        return f'BENCH{rng.randrange(total):07d}'
+
+    def tile(zoom):
+        latitude = rng.uniform(REGION['south'], REGION['north'])
+        longitude = rng.uniform(REGION['west'], REGION['east'])
+        x, y = world_pixel(latitude, longitude, zoom)
+        return f'/api/geo/tiles/{zoom}/{int(x // 256)}/{int(y // 256)}'
+
+    ueops = list(REFERENCE_DATA.current().enterprise_data)
+    return {
+        'search_first_page': [('GET', '/search', None)] * count,
+        'search_by_name': [('GET', '/search?' + urllib.parse.urlencode(
+            {'nome_completo': rng.choice(SURNAMES).lower()}), None) for _ in range(count)],
+        'search_by_ueop_month': [('GET', '/search?' + urllib.parse.urlencode(
+            {'ueop': rng.choice(ueops), 'mes_modificacao': rng.randrange(1, 13)}), None) for _ in range(count)],
+        'search_by_infopen': [('GET', f'/search?infopen={some_infopen()}', None) for _ in range(count)],
+        'seeu_first_page': [('GET', '/seeu', None)] * count,
+        'image_full': [('GET', f'/image/{rng.choice(with_image)}', None) for _ in range(count)] if with_image else [],
+        'image_avatar': [('GET', f'/image/{rng.choice(with_image)}/avatar', None)
+                         for _ in range(count)] if with_image else [],
+        'map_tiles': [('GET', tile(rng.choice([8, 11, 14])), None) for _ in range(count)],
+        'export_csv': [('POST', '/export_csv', {'ueop': rng.choice(ueops)}) for _ in range(max(count // 20, 1))],
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command()
+@click.option('--requests', 'count', default=200, show_default=True, help='Requests per scenario.')
+@click.option('--concurrency', default=1, show_default=True, help='Requests in flight at once.')
+@click.option('--url', help='Drive a running server instead of the in-process test client.')
+@click.option('--only', multiple=True, help='Run only these scenarios.')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), help='JSON file for the results.')
+def run(count, concurrency, url, only, seed, output):
+    """Measure every scenario and report latency percentiles"""
+    create_app()
+    driver = HttpDriver(url) if url else TestClientDriver()
+    scenarios = scenario_requests(random.Random(seed), count)
+
+    results = {}
+    for name, requests in scenarios.items():
+        if not requests or (only and name not in only):
+            continue
+        # One untimed request so caches and connections are warm, as in production
+        driver.request(*requests[0])
+        results[name] = measure(driver, requests, concurrency)
+        summary = results[name]
+        click.echo(f"{name:22} p50 {summary['p50_ms']:8.2f} ms  p95 {summary['p95_ms']:8.2f} ms  "
+                   f"p99 {summary['p99_ms']:8.2f} ms  {summary['throughput_rps']:7.1f} req/s  "
+                   f"sql {summary['sql_queries_mean']}  erros {summary['errors']}")
+
+    with app.app_context():
+        registrations = UserRegistration.query.count()
+        database = db.engine.dialect.name
+    report = {
+        'commit': current_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'database': database,
+        'registrations': registrations,
+        'driver': 'http' if url else 'test_client',
+        'concurrency': concurrency,
+        'results': results,
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        click.echo(f'Resultados gravados em {output}.')
+
+
+@cli.command()
+@click.argument('baseline', type=click.File('r'))
+@click.argument('candidate', type=click.File('r'))
+@click.option('--threshold', default=0.2, show_default=True, help='Relative p95 increase counted as a regression.')
+def compare(baseline, candidate, threshold):
+    """Compare two result files and fail on p95 regressions"""
+    baseline, candidate = json.load(baseline), json.load(candidate)
+    click.echo(f"{baseline['commit']} -> {candidate['commit']}")
+
+    regressions = 0
+    for name, result in candidate['results'].items():
+        previous = baseline['results'].get(name)
+        if not previous:
+            continue
+        change = (result['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] if previous['p95_ms'] else 0
+        regressed = change > threshold
+        regressions += regressed
+        click.echo(f"{'REGRESSÃO' if regressed else 'ok':10} {name:22} p95 {previous['p95_ms']:8.2f} -> "
+                   f"{result['p95_ms']:8.2f} ms ({change:+.0%})  sql {previous['sql_queries_mean']} -> "
+                   f"{result['sql_queries_mean']}")
+
+    if regressions:
+        raise click.ClickException(f'{regressions} cenário(s) mais lentos.')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,36 @@
+"""Gunicorn settings for production: `gunicorn -c gunicorn.conf.py wsgi:app`
+
+GUNICORN_PRESET picks the worker/thread layout for the database in use:
+
+- sqlite: few processes with a handful of threads each. With WAL every
+  process reads concurrently, but writes are serialized by SQLite itself,
+  so more processes only add lock waits.
+- postgresql: the usual (2 x CPUs) + 1 processes, each with a few threads.
+
+Keep DB_POOL_SIZE at least as large as the threads per worker. WEB_WORKERS and
+WEB_THREADS override the preset.
+"""
+import multiprocessing
+import os
+
+PRESETS = {
+    'sqlite': {'workers': min(multiprocessing.cpu_count(), 4), 'threads': 4},
+    'postgresql': {'workers': multiprocessing.cpu_count() * 2 + 1, 'threads': 4},
+}
+
+preset = PRESETS[os.getenv('GUNICORN_PRESET', 'sqlite')]
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', preset['workers']))
+threads = int(os.getenv('WEB_THREADS', preset['threads']))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+# Slow clients on a keep-alive connection shouldn't hold a thread for long
+keepalive = 5
+
+# Load the app once in the master: create_app checks the schema and compiles
+# the templates a single time, and the workers inherit the result on fork
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'